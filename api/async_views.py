@@ -0,0 +1,99 @@
+"""
+Async variants of the read-only catalog and history endpoints, served under
+``/api/async/`` by an ASGI server (``book_storage.asgi``).
+
+They return the same JSON as their DRF counterparts. Single rows are read
+with the async ORM; the cursor pagination and history code shared with the
+sync views runs through ``sync_to_async``. While a request waits for the
+database or for a slow client the event loop keeps serving other requests,
+so one process holds many concurrent connections. Writes stay on the sync
+views and keep their transactions.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .fastpath import book_item, book_values, use_fast_serializers
+from .models import Author, Book
+from .pagination import CatalogCursorPagination
+from .serializers import BookDetailsSerializer, GetAuthorDetailsSerializer
+from .views import BookDetailView, StoringHistoryView
+
+NOT_FOUND = {"detail": "Not found."}
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    """
+    Render ``data`` exactly like DRF's JSON renderer does for the sync views.
+    """
+    return HttpResponse(
+        JSONRenderer().render(data),
+        status=status_code,
+        content_type="application/json",
+    )
+
+
+async def ping_view(request):
+    return JsonResponse({"message": "success"})
+
+
+async def author_detail_view(request, pk):
+    try:
+        author = await Author.objects.aget(pk=pk)
+    except Author.DoesNotExist:
+        return json_response(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    return json_response(GetAuthorDetailsSerializer(author).data)
+
+
+async def book_detail_view(request, pk):
+    try:
+        book = await Book.objects.select_related("author", "books").aget(pk=pk)
+    except Book.DoesNotExist:
+        return json_response(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    return json_response(BookDetailsSerializer(book).data)
+
+
+def book_list_data(request):
+    view = BookDetailView(request=request, format_kwarg=None, args=(), kwargs={})
+    paginator = CatalogCursorPagination()
+    if use_fast_serializers():
+        page = paginator.paginate_queryset(
+            book_values(view.get_queryset()), request, view=view
+        )
+        items = [book_item(row) for row in page]
+    else:
+        page = paginator.paginate_queryset(view.get_queryset(), request, view=view)
+        items = BookDetailsSerializer(page, many=True).data
+    return paginator.get_paginated_response(items).data
+
+
+async def book_list_view(request):
+    """
+    Search and page the books like ``GET /api/book/``.
+    """
+    try:
+        data = await sync_to_async(book_list_data)(Request(request))
+    except ValidationError as exc:
+        return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+    return json_response(data)
+
+
+async def storing_history_view(request, pk):
+    """
+    Return one page of a book's history like ``GET /api/history/<pk>/``.
+    """
+    view = StoringHistoryView(
+        request=Request(request), format_kwarg=None, args=(), kwargs={"pk": pk}
+    )
+    try:
+        book = await view.get_book_queryset().aget(pk=pk)
+    except Book.DoesNotExist:
+        return json_response(NOT_FOUND, status.HTTP_404_NOT_FOUND)
+    try:
+        data = await sync_to_async(view.get_history_data)(book)
+    except ValidationError as exc:
+        return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+    return json_response(data)
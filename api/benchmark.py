@@ -0,0 +1,376 @@
+"""
+Benchmarks of the API hot paths, run by ``manage.py benchmark``.
+
+``seed_catalog`` fills the (throw-away) database with a synthetic catalog.
+Every scenario returns the operations to time, each of them one request or
+one import; ``run_scenario`` times them, optionally from several threads,
+and reports throughput, latency percentiles, queries per operation and the
+peak memory Python allocated while running a sample of them.
+"""
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from .instrumentation import QueryTimer
+from .models import Author, Book, BooksLeftOver, ShopStock, Storing, default_shop_id
+from .search import rebuild_index
+from .utils import handle_excel, handle_text
+
+# Operations whose peak memory is measured, in a separate run.
+MEMORY_SAMPLE = 20
+
+# OPTIONS of the tuned SQLite backend that reproduce plain SQLite: rollback
+# journal, full syncs, small caches, deferred transactions and no write
+# queue. The busy timeout stays at the 5 seconds of Python's sqlite3.
+SQLITE_DEFAULT_OPTIONS = {
+    "pragmas": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    "serialize_writes": False,
+    "transaction_mode": "DEFERRED",
+}
+
+
+def make_barcode(number):
+    return f"{number:013d}"
+
+
+def seed_catalog(books, history, batch_size=5000, seed=0):
+    """
+    Create ``books`` books by ten books per author, each with ``history``
+    Storing rows in the default shop and the matching balances, and index
+    their barcodes.
+    """
+    rng = random.Random(seed)
+    Author.objects.bulk_create(
+        [
+            Author(name=f"Author {i}", birth_date=date(1950, 1, 1))
+            for i in range(max(books // 10, 1))
+        ],
+        batch_size=batch_size,
+    )
+    author_ids = list(Author.objects.values_list("id", flat=True))
+    shop_id = default_shop_id()
+
+    for start in range(0, books, batch_size):
+        numbers = range(start, min(start + batch_size, books))
+        with transaction.atomic():
+            Book.objects.bulk_create(
+                [
+                    Book(
+                        title=f"Book {number}",
+                        publish_year=2000 + number % 24,
+                        author_id=author_ids[number // 10 % len(author_ids)],
+                        barcode=make_barcode(number),
+                    )
+                    for number in numbers
+                ]
+            )
+            book_ids = Book.objects.filter(
+                barcode__gte=make_barcode(numbers[0]),
+                barcode__lte=make_barcode(numbers[-1]),
+            ).values_list("id", flat=True)
+            storing = []
+            balances = []
+            shop_balances = []
+            for book_id in book_ids:
+                quantities = [rng.randint(-5, 20) for _ in range(history)]
+                storing.extend(
+                    Storing(book_id=book_id, quantity=quantity)
+                    for quantity in quantities
+                )
+                balances.append(
+                    BooksLeftOver(book_id=book_id, quantity=sum(quantities))
+                )
+                shop_balances.append(
+                    ShopStock(
+                        shop_id=shop_id, book_id=book_id, quantity=sum(quantities)
+                    )
+                )
+            Storing.objects.bulk_create(storing, batch_size=batch_size)
+            BooksLeftOver.objects.bulk_create(balances, batch_size=batch_size)
+            ShopStock.objects.bulk_create(shop_balances, batch_size=batch_size)
+
+    rebuild_index(batch_size)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def run_operations(operations, concurrency=1):
+    """
+    Run the operations, ``concurrency`` threads at a time. Returns the
+    per-operation ``(seconds, ok)`` results, the queries run and the wall
+    clock time.
+    """
+
+    def work(chunk):
+        timer = QueryTimer()
+        results = []
+        try:
+            with connection.execute_wrapper(timer):
+                for operation in chunk:
+                    start = time.perf_counter()
+                    try:
+                        ok = operation() is not False
+                    except Exception:
+                        ok = False
+                    results.append((time.perf_counter() - start, ok))
+        finally:
+            if concurrency > 1:
+                connection.close()
+        return results, timer.queries
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        chunks = [operations[i::concurrency] for i in range(concurrency)]
+        with ThreadPoolExecutor(concurrency) as executor:
+            outcomes = list(executor.map(work, chunks))
+    else:
+        outcomes = [work(operations)]
+    wall = time.perf_counter() - start
+
+    results = [result for chunk_results, _ in outcomes for result in chunk_results]
+    return results, sum(queries for _, queries in outcomes), wall
+
+
+def peak_memory(operations):
+    """
+    Peak bytes allocated by Python while running the operations.
+    """
+    tracemalloc.start()
+    try:
+        for operation in operations:
+            try:
+                operation()
+            except Exception:
+                pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(scenario, options):
+    """
+    Time one scenario and return its report.
+    """
+    operations, concurrency, rows = scenario(options)
+    results, queries, wall = run_operations(operations, concurrency)
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    report = {
+        "operations": len(results),
+        "errors": sum(not ok for _, ok in results),
+        "concurrency": concurrency,
+        "seconds": round(wall, 3),
+        "throughput_per_s": round(len(results) / wall, 3) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "max": round(latencies[-1], 3),
+        },
+        "queries_per_operation": round(queries / len(results), 3),
+    }
+    if rows:
+        report["rows_per_s"] = round(rows * len(results) / wall, 3)
+    if options["memory"]:
+        report["peak_memory_kb"] = round(
+            peak_memory(operations[:MEMORY_SAMPLE]) / 1024, 1
+        )
+    return report
+
+
+def get_ok(client, url):
+    return client.get(url).status_code < 400
+
+
+def book_list(options):
+    client = Client()
+    url = "/api/book/?page_size=100"
+    return [lambda: get_ok(client, url)] * options["requests"], 1, 0
+
+
+def book_list_drf(options):
+    """
+    The book list serialized by DRF serializers instead of the fast path.
+    """
+    operations, concurrency, rows = book_list(options)
+
+    def drf(operation):
+        with override_settings(API_FAST_SERIALIZERS=False):
+            return operation()
+
+    return [lambda op=op: drf(op) for op in operations], concurrency, rows
+
+
+def book_detail(options):
+    """
+    A tiny endpoint, where connecting to the database is a visible part of
+    the latency.
+    """
+    client = Client()
+    book_ids = list(Book.objects.values_list("id", flat=True)[:10000])
+    rng = random.Random(6)
+    urls = [f"/api/book/{rng.choice(book_ids)}/" for _ in range(options["requests"])]
+    return [lambda url=url: get_ok(client, url) for url in urls], 1, 0
+
+
+def barcode_search(options):
+    client = Client()
+    rng = random.Random(1)
+    operations = []
+    for _ in range(options["requests"]):
+        barcode = make_barcode(rng.randrange(options["books"]))
+        term = barcode[-6:-1]
+        url = f"/api/book/?barcode={term}"
+        operations.append(lambda url=url: get_ok(client, url))
+    return operations, 1, 0
+
+
+def history(options):
+    client = Client()
+    book_ids = list(Book.objects.values_list("id", flat=True)[:10000])
+    rng = random.Random(2)
+    urls = [
+        f"/api/history/{rng.choice(book_ids)}/" for _ in range(options["requests"])
+    ]
+    return [lambda url=url: get_ok(client, url) for url in urls], 1, 0
+
+
+def leftover_adjustments(options):
+    rng = random.Random(3)
+    clients = {}
+
+    def adjust(barcode):
+        # Django's test client is not thread-safe: one per thread.
+        client = clients.setdefault(threading.get_ident(), Client())
+        response = client.post(
+            "/api/leftover/add/",
+            {"barcode": barcode, "quantity": 1},
+            content_type="application/json",
+        )
+        return response.status_code < 400
+
+    barcodes = [
+        make_barcode(rng.randrange(options["books"]))
+        for _ in range(options["requests"])
+    ]
+    return (
+        [lambda barcode=barcode: adjust(barcode) for barcode in barcodes],
+        options["concurrency"],
+        0,
+    )
+
+
+def mixed_read_write(options):
+    """
+    History reads and batch leftover adjustments, half and half, sent from
+    ``concurrency`` threads at once.
+    """
+    rng = random.Random(5)
+    clients = {}
+    book_ids = list(Book.objects.values_list("id", flat=True)[:10000])
+
+    def client():
+        # Django's test client is not thread-safe: one per thread.
+        return clients.setdefault(threading.get_ident(), Client())
+
+    def read(book_id):
+        return get_ok(client(), f"/api/history/{book_id}/")
+
+    def write(barcodes):
+        entries = [
+            {"barcode": barcode, "quantity": 1, "op": "add"} for barcode in barcodes
+        ]
+        response = client().post(
+            "/api/leftover/batch/", entries, content_type="application/json"
+        )
+        return response.status_code < 400
+
+    operations = []
+    for number in range(options["requests"]):
+        if number % 2:
+            barcodes = [
+                make_barcode(rng.randrange(options["books"])) for _ in range(5)
+            ]
+            operations.append(lambda barcodes=barcodes: write(barcodes))
+        else:
+            book_id = rng.choice(book_ids)
+            operations.append(lambda book_id=book_id: read(book_id))
+    return operations, options["concurrency"], 0
+
+
+@contextmanager
+def import_file(rows, books, suffix):
+    """
+    Write an import file of ``rows`` rows for random existing books.
+    """
+    rng = random.Random(4)
+    with tempfile.NamedTemporaryFile(suffix=suffix) as file:
+        if suffix == ".xlsx":
+            from openpyxl import Workbook
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(["barcode", "quantity"])
+            for _ in range(rows):
+                sheet.append([make_barcode(rng.randrange(books)), rng.randint(1, 9)])
+            workbook.save(file.name)
+        else:
+            for _ in range(rows):
+                file.write(
+                    b"BRC%s\nQNT%d\n"
+                    % (make_barcode(rng.randrange(books)).encode(), rng.randint(1, 9))
+                )
+            file.flush()
+        yield file.name
+
+
+def text_import(options):
+    return import_scenario(options, ".txt", handle_text)
+
+
+def excel_import(options):
+    return import_scenario(options, ".xlsx", handle_excel)
+
+
+def import_scenario(options, suffix, handle):
+    rows = options["import_rows"]
+    path = options["cleanup"].enter_context(import_file(rows, options["books"], suffix))
+
+    def run():
+        with open(path, "rb") as file:
+            return handle(file) is True
+
+    return [run] * options["imports"], 1, rows
+
+
+SCENARIOS = {
+    "book-list": book_list,
+    "book-list-drf": book_list_drf,
+    "book-detail": book_detail,
+    "barcode-search": barcode_search,
+    "history": history,
+    "leftover-adjustments": leftover_adjustments,
+    "mixed-read-write": mixed_read_write,
+    "text-import": text_import,
+    "excel-import": excel_import,
+}
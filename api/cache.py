@@ -0,0 +1,153 @@
+"""
+Read-through cache of serialized API responses.
+
+Responses are cached per URL together with the generations of the
+resources they were built from, e.g. ``book:12`` or ``book-list``. Writes
+invalidate precisely by replacing the generation of what they touched,
+which makes every response built from the old data unreachable; it is then
+evicted by the cache backend (LRU for the local-memory backend).
+
+Generations are random tokens rather than counters so that an evicted
+generation can never bring an old response back.
+
+Only responses read from the primary are stored: a replica that lags behind
+would otherwise cache old rows under the new generation, and serve them even
+to the clients pinned to the primary to read their own writes.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import reads_from_primary
+
+# Invalidating more books than this at once bumps ``books-all`` instead.
+MAX_BOOKS_PER_INVALIDATION = 100
+
+
+def get_api_cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def get_cache_timeout():
+    return getattr(settings, "API_CACHE_TIMEOUT", 0)
+
+
+def generation_key(namespace):
+    return f"api:gen:{namespace}"
+
+
+def get_generations(namespaces):
+    """
+    Return the current generation of every namespace, starting new ones for
+    namespaces that have none (yet, or any more).
+    """
+    cache = get_api_cache()
+    keys = [generation_key(namespace) for namespace in namespaces]
+    generations = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def invalidate(*namespaces):
+    """
+    Drop every cached response built from the given namespaces.
+
+    The generations are replaced right away and again once the current
+    transaction commits, so a response computed from the old rows in the
+    meantime is not served afterwards.
+    """
+    if not namespaces:
+        return
+
+    def bump():
+        get_api_cache().set_many(
+            {generation_key(namespace): uuid.uuid4().hex for namespace in namespaces},
+            timeout=None,
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_books(book_ids):
+    """
+    Drop the cached book details, history and lists of the given books.
+    """
+    book_ids = set(book_ids)
+    if len(book_ids) > MAX_BOOKS_PER_INVALIDATION:
+        invalidate("books-all")
+        return
+    invalidate(
+        "book-list",
+        *(f"book:{book_id}" for book_id in book_ids),
+        *(f"history:{book_id}" for book_id in book_ids),
+    )
+
+
+def response_key(request, namespaces):
+    generations = get_generations(namespaces)
+    raw = "|".join([request.get_full_path(), *namespaces, *generations])
+    return "api:response:" + hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_response(*namespaces):
+    """
+    Cache the data of successful responses of a view method for
+    ``API_CACHE_TIMEOUT`` seconds, if it is set.
+
+    ``namespaces`` are the resources the response is built from; they are
+    formatted with the URL kwargs, e.g. ``"book:{pk}"``. The ``ETag`` and
+    ``Last-Modified`` headers are cached with the data, so that a hit also
+    answers conditional requests without asking the view for its version:
+    put this decorator outside of ``conditional_response``.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            timeout = get_cache_timeout()
+            if not timeout:
+                return method(view, request, *args, **kwargs)
+
+            key = response_key(
+                request, [namespace.format(**kwargs) for namespace in namespaces]
+            )
+            cache = get_api_cache()
+            entry = cache.get(key)
+            if entry is not None:
+                headers = entry["headers"]
+                not_modified = get_conditional_response(
+                    request,
+                    etag=headers.get("ETag"),
+                    last_modified=parse_http_date_safe(
+                        headers.get("Last-Modified", "")
+                    ),
+                )
+                if not_modified is not None:
+                    return not_modified
+                return Response(entry["data"], headers=headers)
+
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK and reads_from_primary():
+                headers = {
+                    name: response.headers[name]
+                    for name in ("ETag", "Last-Modified")
+                    if name in response.headers
+                }
+                cache.set(key, {"data": response.data, "headers": headers}, timeout)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,78 @@
+"""
+Compaction of the Storing history.
+
+Rows older than a horizon are folded into one ``StockSnapshot`` per book at
+the horizon, optionally archived to a gzipped CSV file, and deleted. Book
+balances are unaffected, balances at or after the horizon stay exact and
+the history endpoints start from the snapshot instead of the deleted rows.
+The horizon is recorded as a ``HistoryCompaction``; requests for balances
+before it are rejected, since they can no longer be worked out.
+"""
+import csv
+import gzip
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import BooksLeftOver, HistoryCompaction, Storing
+from .routers import use_primary
+from .stock import create_snapshots
+
+ARCHIVE_FIELDS = ["id", "book_id", "shop_id", "quantity", "date"]
+
+
+def archive_history(rows, archive_dir, horizon):
+    """
+    Write Storing rows to a gzipped CSV file in ``archive_dir`` and return
+    its path. Rows are streamed from the database in chunks.
+    """
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / "storing-before-{}-{}.csv.gz".format(
+        horizon.strftime("%Y%m%dT%H%M%S"), timezone.now().strftime("%Y%m%dT%H%M%S")
+    )
+    with gzip.open(path, "wt", newline="") as archive:
+        writer = csv.writer(archive)
+        writer.writerow(ARCHIVE_FIELDS)
+        for row in rows.order_by("id").values_list(*ARCHIVE_FIELDS).iterator(
+            chunk_size=5000
+        ):
+            writer.writerow([*row[:-1], row[-1].isoformat()])
+    return path
+
+
+def compact_history(horizon, archive_dir=None, batch_size=5000):
+    """
+    Fold the Storing rows dated before ``horizon`` into snapshots.
+
+    Returns ``{"snapshots", "deleted", "archive"}``. The snapshots and the
+    deletion happen in one transaction, after the archive (if any) has been
+    written, so an interrupted run loses nothing and can simply be repeated.
+    """
+    # The archive is read outside the transaction, where a lagging replica
+    # could miss rows that are then deleted without being archived.
+    with use_primary():
+        old_rows = Storing.objects.filter(date__lt=horizon)
+        archive = None
+        if archive_dir and old_rows.exists():
+            archive = archive_history(old_rows, archive_dir, horizon)
+
+        deleted = 0
+        with transaction.atomic():
+            snapshots = create_snapshots(horizon, batch_size=batch_size)
+            # The history of these books changes, so their version does too.
+            BooksLeftOver.objects.filter(
+                book_id__in=old_rows.values("book_id")
+            ).update(updated_at=timezone.now())
+            while True:
+                batch = list(old_rows.values_list("id", flat=True)[:batch_size])
+                if not batch:
+                    break
+                deleted += Storing.objects.filter(id__in=batch).delete()[0]
+            if deleted:
+                HistoryCompaction.objects.create(horizon=horizon, deleted=deleted)
+                invalidate("books-all")
+
+        return {"snapshots": snapshots, "deleted": deleted, "archive": archive}
@@ -0,0 +1,61 @@
+"""
+Conditional GET support.
+
+Views define ``get_version()`` returning the parts that identify the current
+state of what they show: ``updated_at`` stamps, and for lists the stamps and
+keys of the rows on the requested page plus the total count, so that
+deletions are noticed. Details take one small query, lists a count and one
+page of stamps, never an aggregate over every row. Responses carry the
+version as ``ETag``, and as ``Last-Modified`` when it has datetime parts
+(lists pass theirs as strings: a deletion does not change the newest
+stamp). Requests whose ``If-None-Match`` or ``If-Modified-Since`` still match
+get a 304 before anything is serialized.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+
+
+def version_headers(request, parts):
+    """
+    Return the ``(etag, last_modified)`` of a response made of ``parts``;
+    ``last_modified`` is a timestamp, or None without any dates among them.
+    """
+    raw = "|".join([request.get_full_path(), *map(str, parts)])
+    etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+    dates = [part for part in parts if isinstance(part, datetime)]
+    last_modified = int(max(dates).timestamp()) if dates else None
+    return etag, last_modified
+
+
+def conditional_response(method):
+    """
+    Answer conditional requests to a view method from ``view.get_version()``.
+    A version of None (e.g. an unknown object) leaves the request to the view.
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        parts = view.get_version()
+        if parts is None:
+            return method(view, request, *args, **kwargs)
+
+        etag, last_modified = version_headers(request, parts)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            return not_modified
+
+        response = method(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response.headers["ETag"] = etag
+            if last_modified is not None:
+                response.headers["Last-Modified"] = http_date(last_modified)
+        return response
+
+    return wrapper
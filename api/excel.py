@@ -0,0 +1,199 @@
+"""
+Parsing and validation of ``barcode``/``quantity`` stock sheets.
+
+Nothing in here touches the database so that the functions can run in
+worker processes; resolving barcodes and saving rows is left to
+``api.utils``.
+"""
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from .quantities import MAX_QUANTITY, MIN_QUANTITY
+
+# Text cells must hold an integer, as ``int()`` used to require.
+INTEGER_TEXT = r"\s*[+-]?\d+\s*"
+
+BLANK_QUANTITY = "Error at row {row}. Quantity cannot be blank."
+INVALID_QUANTITY = "Invalid quantity at row {row}. Quantity must be a number."
+
+
+def find_columns(header):
+    """
+    Return the ``(barcode, quantity)`` column indexes of a header row, or
+    None when the sheet has no quantity column.
+    """
+    columns = {name: i for i, name in enumerate(header or ()) if name}
+    if "quantity" not in columns:
+        return None
+    return columns.get("barcode"), columns["quantity"]
+
+
+def data_sheets(workbook):
+    """
+    List ``(title, barcode_col, quantity_col, max_row)`` for every sheet
+    that has a quantity column.
+    """
+    sheets = []
+    for sheet in workbook.worksheets:
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        columns = find_columns(header)
+        if columns is not None:
+            sheets.append((sheet.title, *columns, sheet.max_row))
+    if not sheets:
+        raise KeyError("quantity")
+    return sheets
+
+
+def sheet_prefix(title, sheet_count):
+    """
+    Error message prefix naming the sheet, used for multi-sheet workbooks.
+    """
+    return f"Sheet '{title}': " if sheet_count > 1 else ""
+
+
+def row_messages(row_numbers, template, prefix=""):
+    """
+    Format ``template`` for a whole series of row numbers at once.
+    """
+    before, after = template.split("{row}")
+    return prefix + before + row_numbers.astype(str) + after
+
+
+def not_found_messages(row_numbers, barcodes, prefix=""):
+    return (
+        prefix
+        + "Error at row "
+        + row_numbers.astype(str)
+        + ". Book with barcode: "
+        + barcodes
+        + " does not exist"
+    )
+
+
+def frame_from_rows(rows, barcode_col, quantity_col, first_row_number):
+    """
+    Build a ``row_number``/``barcode``/``quantity`` frame of raw cell values
+    from spreadsheet rows.
+    """
+    rows = list(rows)
+    width = max(quantity_col, -1 if barcode_col is None else barcode_col) + 1
+    values = np.full((len(rows), width), None, dtype=object)
+    for i, row in enumerate(rows):
+        row = row[:width]
+        values[i, : len(row)] = row
+
+    return pd.DataFrame(
+        {
+            "row_number": np.arange(first_row_number, first_row_number + len(rows)),
+            "barcode": values[:, barcode_col] if barcode_col is not None else None,
+            "quantity": values[:, quantity_col],
+        }
+    )
+
+
+def validate_frame(frame, prefix=""):
+    """
+    Validate a raw frame column-wise.
+
+    Returns ``(clean, errors)``: ``clean`` holds the ``row_number``,
+    ``barcode`` and integer ``quantity`` of the usable rows, ``errors`` the
+    ``row_number`` and ``message`` of every rejected row. Rows without a
+    barcode are skipped.
+    """
+    barcode = frame["barcode"].where(frame["barcode"].notna(), "")
+    kinds = barcode.map(type)
+    # Integral float cells would otherwise print as "12345.0".
+    floats = kinds == float
+    if floats.any():
+        numbers = barcode[floats].astype(float)
+        integral = numbers == np.floor(numbers)
+        barcode[floats & integral.reindex(barcode.index, fill_value=False)] = (
+            numbers[integral].astype("int64").astype(str)
+        )
+    strings = kinds == str
+    if strings.any():
+        barcode[strings] = barcode[strings].str.strip()
+    barcode = barcode.astype(str)
+    frame = frame.assign(barcode=barcode)[barcode != ""]
+
+    raw = frame["quantity"]
+    quantity = pd.to_numeric(raw, errors="coerce").astype(float)
+    text = raw.map(type) == str
+    if text.any():
+        integral = raw[text].str.fullmatch(INTEGER_TEXT)
+        quantity[text & ~integral.reindex(raw.index, fill_value=True)] = np.nan
+    quantity = np.trunc(quantity)
+    blank = raw.isna() | (raw == "")
+    invalid = ~blank & ~(
+        np.isfinite(quantity)
+        & (quantity >= MIN_QUANTITY)
+        & (quantity <= MAX_QUANTITY)
+    )
+    valid = ~blank & ~invalid
+
+    row_numbers = frame["row_number"]
+    errors = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "row_number": row_numbers[blank],
+                    "message": row_messages(
+                        row_numbers[blank], BLANK_QUANTITY, prefix
+                    ),
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "row_number": row_numbers[invalid],
+                    "message": row_messages(
+                        row_numbers[invalid], INVALID_QUANTITY, prefix
+                    ),
+                }
+            ),
+        ]
+    ).sort_values("row_number", kind="stable")
+
+    clean = pd.DataFrame(
+        {
+            "row_number": row_numbers[valid],
+            "barcode": frame["barcode"][valid],
+            "quantity": quantity[valid].astype("int64"),
+        }
+    )
+    return clean, errors
+
+
+def plan_parts(path):
+    """
+    Split a workbook into ``(title, barcode_col, quantity_col, prefix)``
+    parts, one per sheet.
+
+    Sheets are not split further into row ranges: openpyxl parses a sheet's
+    XML from the top even for ``iter_rows(min_row=...)``, so the part with
+    the last rows would take longer than parsing the whole sheet at once.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = data_sheets(workbook)
+    finally:
+        workbook.close()
+
+    return [
+        (title, barcode_col, quantity_col, sheet_prefix(title, len(sheets)))
+        for title, barcode_col, quantity_col, _ in sheets
+    ]
+
+
+def parse_part(path, part):
+    """
+    Read and validate one sheet of a workbook; runs in a worker process.
+    """
+    title, barcode_col, quantity_col, prefix = part
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[title].iter_rows(min_row=2, values_only=True)
+        frame = frame_from_rows(rows, barcode_col, quantity_col, 2)
+    finally:
+        workbook.close()
+    return validate_frame(frame, prefix)
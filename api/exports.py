@@ -0,0 +1,162 @@
+"""
+Streaming exports of the catalog and the Storing history.
+
+Rows are read with ``iterator(chunk_size=...)`` as plain tuples, with the
+author and barcode columns joined in by the query, and written out chunk by
+chunk, so memory use does not grow with the number of rows. CSV and NDJSON
+are streamed while they are produced; XLSX is a zip archive that can only
+be sent once complete, so it is written to a temporary file by openpyxl's
+write-only mode first and then streamed from there.
+"""
+import csv
+import io
+import json
+import tempfile
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, StreamingHttpResponse
+
+from .models import Book, Storing
+from .utils import iter_chunks
+
+EXPORT_FORMATS = ("csv", "ndjson", "xlsx")
+
+BOOK_COLUMNS = {
+    "id": "id",
+    "barcode": "barcode",
+    "title": "title",
+    "publish_year": "publish_year",
+    "author_id": "author_id",
+    "author_name": "author__name",
+    "author_birth_date": "author__birth_date",
+    "quantity": "balance",
+}
+
+HISTORY_COLUMNS = {
+    "id": "id",
+    "book_id": "book_id",
+    "barcode": "book__barcode",
+    "shop_id": "shop_id",
+    "date": "date",
+    "quantity": "quantity",
+}
+
+
+def get_export_chunk_size():
+    return getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+
+
+def book_rows():
+    """
+    Every book with its author and current balance, in id order.
+    """
+    return (
+        Book.objects.annotate(balance=Coalesce(F("books__quantity"), Value(0)))
+        .order_by("id")
+        .values_list(*BOOK_COLUMNS.values())
+    )
+
+
+def history_rows(date_from=None, date_to=None, book=None, shop=None):
+    """
+    Storing rows in ``[date_from, date_to)``, optionally of one book and
+    shop, in id order.
+    """
+    rows = Storing.objects.all()
+    if date_from is not None:
+        rows = rows.filter(date__gte=date_from)
+    if date_to is not None:
+        rows = rows.filter(date__lt=date_to)
+    if book is not None:
+        rows = rows.filter(book_id=book)
+    if shop is not None:
+        rows = rows.filter(shop=shop)
+    return rows.order_by("id").values_list(*HISTORY_COLUMNS.values())
+
+
+def text_value(value):
+    """
+    Dates as in the JSON API (ISO 8601, "Z" for UTC), everything else as is.
+    """
+    if isinstance(value, (date, datetime)):
+        return DjangoJSONEncoder().default(value)
+    return value
+
+
+def excel_value(value):
+    """
+    Excel has no time zones: datetimes are written as naive UTC.
+    """
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def csv_chunks(columns, rows, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in iter_chunks(rows, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([[text_value(value) for value in row] for row in chunk])
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(columns, rows, chunk_size):
+    for chunk in iter_chunks(rows, chunk_size):
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
+            for row in chunk
+        )
+
+
+def xlsx_file(title, columns, rows):
+    """
+    Write the rows to an anonymous temporary .xlsx file, rewound.
+    """
+    # Only loaded once an XLSX export is requested, see api.utils.
+    from openpyxl import Workbook
+
+    file = tempfile.TemporaryFile()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([excel_value(value) for value in row])
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def export_response(name, columns, queryset, export_format):
+    """
+    Return a response streaming ``queryset`` as a ``name`` attachment in
+    ``export_format``, one of ``EXPORT_FORMATS``.
+    """
+    chunk_size = get_export_chunk_size()
+    columns = list(columns)
+    rows = queryset.iterator(chunk_size=chunk_size)
+    filename = f"{name}.{export_format}"
+
+    if export_format == "xlsx":
+        return FileResponse(
+            xlsx_file(name, columns, rows), as_attachment=True, filename=filename
+        )
+
+    if export_format == "ndjson":
+        response = StreamingHttpResponse(
+            ndjson_chunks(columns, rows, chunk_size),
+            content_type="application/x-ndjson",
+        )
+    else:
+        response = StreamingHttpResponse(
+            csv_chunks(columns, rows, chunk_size), content_type="text/csv"
+        )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,290 @@
+"""
+Per-endpoint request instrumentation.
+
+``InstrumentationMiddleware`` measures every request routed to a named URL:
+its latency, the number and total duration of its database queries, the
+time spent turning objects into response data (``serialize_ms``: serializer
+``to_representation`` and the fast-path item functions, see
+``serializing()``) and the time spent rendering that data to JSON
+(``render_ms``). The numbers
+are aggregated per URL name in this process, served by ``stats_view`` and,
+with ``INSTRUMENTATION_LOG_REQUESTS``, logged as one JSON line per request on
+the ``api.instrumentation`` logger.
+
+Queries are counted by ``timed_execute``, an execute wrapper installed on
+every database connection when it is opened, whichever thread opens it. It
+counts towards the ``QueryTimer`` of the request's context, which
+``sync_to_async`` and the async ORM carry over to the threads that run the
+queries of async views. It costs one function call per query, so the
+middleware can stay on in production.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# The QueryTimer and SerializationTimer of the request being measured, if any.
+_query_timer = ContextVar("query_timer", default=None)
+_serialization = ContextVar("serialization", default=None)
+
+
+class EndpointStats:
+    """
+    Running totals of the requests to one URL name.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.queries = 0
+        self.max_queries = 0
+        self.db_ms = 0.0
+        self.serialize_ms = 0.0
+        self.render_ms = 0.0
+
+    def add(self, sample):
+        self.requests += 1
+        self.errors += sample["status"] >= 500
+        self.latency_ms += sample["latency_ms"]
+        self.max_latency_ms = max(self.max_latency_ms, sample["latency_ms"])
+        self.histogram[bisect_left(LATENCY_BUCKETS_MS, sample["latency_ms"])] += 1
+        self.queries += sample["queries"]
+        self.max_queries = max(self.max_queries, sample["queries"])
+        self.db_ms += sample["db_ms"]
+        self.serialize_ms += sample["serialize_ms"]
+        self.render_ms += sample["render_ms"]
+
+    def as_dict(self):
+        requests = self.requests or 1
+        buckets = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": {
+                "mean": round(self.latency_ms / requests, 3),
+                "max": round(self.max_latency_ms, 3),
+                "histogram": dict(zip(buckets, self.histogram)),
+            },
+            "queries": {
+                "mean": round(self.queries / requests, 3),
+                "max": self.max_queries,
+            },
+            "db_ms": {"mean": round(self.db_ms / requests, 3)},
+            "serialize_ms": {"mean": round(self.serialize_ms / requests, 3)},
+            "render_ms": {"mean": round(self.render_ms / requests, 3)},
+        }
+
+
+class StatsRegistry:
+    """
+    Thread-safe ``EndpointStats`` by URL name.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, url_name, sample):
+        with self.lock:
+            self.endpoints.setdefault(url_name, EndpointStats()).add(sample)
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.as_dict() for name, stats in self.endpoints.items()}
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+registry = StatsRegistry()
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and their total duration.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+def timed_execute(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection):
+    """
+    Count the queries of ``connection`` towards the measured request.
+    """
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
+
+
+class SerializationTimer:
+    """
+    Total time spent in ``serializing()`` blocks, counting nested blocks once.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.depth = 0
+
+
+@contextmanager
+def serializing():
+    """
+    Count the time spent in the block towards the ``serialize_ms`` of the
+    request being measured; does nothing outside of measured requests.
+    """
+    timer = _serialization.get()
+    if timer is None:
+        yield
+        return
+    timer.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        if not timer.depth:
+            timer.seconds += time.perf_counter() - start
+
+
+class InstrumentationMiddleware:
+    """
+    Record the latency, queries, DB time, serialization time and render time
+    of every request to
+    a named URL, if ``INSTRUMENTATION_ENABLED``. Works in sync and async
+    middleware chains, so async views stay async.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", False):
+            return self.get_response(request)
+
+        with self.measure(request) as measurement:
+            measurement["response"] = self.get_response(request)
+        return measurement["response"]
+
+    async def __acall__(self, request):
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", False):
+            return await self.get_response(request)
+
+        with self.measure(request) as measurement:
+            measurement["response"] = await self.get_response(request)
+        return measurement["response"]
+
+    @contextmanager
+    def measure(self, request):
+        """
+        Time the request handled in the block, which stores its response in
+        the yielded dict, and record it.
+        """
+        timer = QueryTimer()
+        serialization = SerializationTimer()
+        measurement = {}
+        request._render_seconds = 0.0
+        # Connections opened before the connection_created receiver was.
+        for connection in connections.all():
+            install_query_timer(connection)
+        start = time.perf_counter()
+        tokens = _query_timer.set(timer), _serialization.set(serialization)
+        try:
+            yield measurement
+        finally:
+            _query_timer.reset(tokens[0])
+            _serialization.reset(tokens[1])
+        latency = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        if match is None or not match.url_name:
+            return
+        sample = {
+            "endpoint": match.url_name,
+            "method": request.method,
+            "status": measurement["response"].status_code,
+            "latency_ms": round(latency * 1000, 3),
+            "queries": timer.queries,
+            "db_ms": round(timer.seconds * 1000, 3),
+            "serialize_ms": round(serialization.seconds * 1000, 3),
+            "render_ms": round(request._render_seconds * 1000, 3),
+        }
+        registry.record(match.url_name, sample)
+        if getattr(settings, "INSTRUMENTATION_LOG_REQUESTS", False):
+            logger.info(json.dumps(sample))
+
+    def process_template_response(self, request, response):
+        """
+        Time the rendering of DRF responses to JSON, which happens after the
+        view, for the requests that are measured.
+        """
+        if getattr(request, "_render_seconds", None) is None:
+            return response
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._render_seconds += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def pool_stats():
+    """
+    The stats of the connection pools of this process, by database alias.
+    """
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        if pool is not None:
+            stats[alias] = pool.stats()
+    return stats
+
+
+def stats_view(request):
+    """
+    Return the per-endpoint and connection pool stats of this process. Only
+    answers clients listed in ``INTERNAL_IPS``.
+    """
+    if request.META.get("REMOTE_ADDR") not in getattr(settings, "INTERNAL_IPS", ()):
+        raise Http404
+    return JsonResponse({"endpoints": registry.snapshot(), "pool": pool_stats()})
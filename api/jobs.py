@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import ImportJob
+from api.routers import use_primary
+from api.utils import handle_excel, handle_text
+
+logger = logging.getLogger(__name__)
+
+
+class JobLost(Exception):
+    """
+    Another worker claimed the job again and saved a chunk of it first.
+    """
+
+
+def enqueue_import(file, shop_id=None):
+    """
+    Store an uploaded file and queue it for a background worker to import
+    into the given shop (by default ``DEFAULT_SHOP_ID``).
+    """
+    return ImportJob.objects.create(file=file, shop_id=shop_id)
+
+
+def get_job_lease():
+    """
+    Seconds without a heartbeat after which a running job is claimed again.
+    """
+    return getattr(settings, "IMPORT_JOB_LEASE_SECONDS", 300)
+
+
+def get_max_errors():
+    """
+    Error messages kept on a job; ``rows_failed`` still counts every one.
+    """
+    return getattr(settings, "IMPORT_JOB_MAX_ERRORS", 1000)
+
+
+def claim_job():
+    """
+    Atomically move the oldest pending job to running and return it. If no
+    job is pending, reclaim the oldest running job whose worker stopped
+    sending heartbeats, e.g. because it was killed.
+
+    The conditional UPDATE makes sure two workers never pick the same job,
+    without relying on row locks the database may not support.
+    """
+    now = timezone.now()
+    stale = Q(status=ImportJob.RUNNING) & (
+        Q(heartbeat__lt=now - timedelta(seconds=get_job_lease()))
+        | Q(heartbeat__isnull=True)
+    )
+    for claimable in [Q(status=ImportJob.PENDING), stale]:
+        candidates = ImportJob.objects.filter(claimable).order_by("id")
+        for job_id in candidates.values_list("id", flat=True)[:10]:
+            claimed = ImportJob.objects.filter(claimable, id=job_id).update(
+                status=ImportJob.RUNNING, started=now, heartbeat=now
+            )
+            if claimed:
+                job = ImportJob.objects.get(id=job_id)
+                if claimable is stale:
+                    logger.warning(
+                        "Reclaimed import job %s after %s chunk(s)",
+                        job.id,
+                        job.chunks_done,
+                    )
+                return job
+    return None
+
+
+def bump_heartbeat(job):
+    """
+    Record that the worker of the job is alive. Errors, e.g. "database is
+    locked" while a long chunk is being saved, are logged: the next beat may
+    get through, and run_job detects a job that was claimed again meanwhile.
+    """
+    try:
+        ImportJob.objects.filter(id=job.id).update(heartbeat=timezone.now())
+    except Exception:
+        logger.exception("Could not record the heartbeat of import job %s", job.id)
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Bump the heartbeat of the job from a background thread while the block
+    runs, so that long chunks do not look like a dead worker.
+    """
+    stopped = threading.Event()
+    interval = get_job_lease() / 3
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                bump_heartbeat(job)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    """
+    Import the file of a claimed job, recording progress and the first
+    ``IMPORT_JOB_MAX_ERRORS`` error messages with every chunk, in the
+    chunk's transaction. A reclaimed job resumes after the chunks saved
+    before.
+
+    Every update expects the ``chunks_done`` this worker saw last. If
+    another worker claimed the job again and saved a chunk first, the update
+    matches no row: the chunk is rolled back and the job left to the other
+    worker, so no chunk is imported twice.
+    """
+    job_rows = ImportJob.objects.filter(id=job.id)
+    errors = list(job.errors)
+    max_errors = get_max_errors()
+    chunks_done = job.chunks_done
+
+    def on_chunk(processed, messages):
+        nonlocal chunks_done
+        changes = {
+            "rows_processed": F("rows_processed") + processed,
+            "rows_failed": F("rows_failed") + len(messages),
+            "chunks_done": F("chunks_done") + 1,
+            "heartbeat": timezone.now(),
+        }
+        # Only rewrite the errors while the sample still grows, instead of
+        # every chunk of a file with millions of rows.
+        sample = messages[: max_errors - len(errors)]
+        if sample:
+            errors.extend(sample)
+            changes["errors"] = errors
+        if not job_rows.filter(chunks_done=chunks_done).update(**changes):
+            raise JobLost(f"Import job {job.id} was claimed by another worker")
+        chunks_done += 1
+
+    options = {
+        "on_chunk": on_chunk,
+        "shop_id": job.shop_id,
+        "skip_chunks": job.chunks_done,
+    }
+    try:
+        # Books created just before the upload may not be on the replicas yet.
+        with use_primary(), heartbeat(job), job.file.open("rb") as file:
+            if job.file.name.lower().endswith(".xlsx"):
+                handle_excel(file, **options)
+            else:
+                handle_text(file, **options)
+    except JobLost:
+        logger.warning("Import job %s was claimed by another worker", job.id)
+        finished = 0
+    except Exception as e:
+        logger.exception("Import job %s failed", job.id)
+        finished = job_rows.filter(chunks_done=chunks_done).update(
+            status=ImportJob.FAILED,
+            errors=errors + [str(e)],
+            finished=timezone.now(),
+        )
+    else:
+        finished = job_rows.filter(chunks_done=chunks_done).update(
+            status=ImportJob.DONE, finished=timezone.now()
+        )
+    if finished:
+        # The upload is only needed while the job runs.
+        job.file.delete(save=False)
+        job_rows.update(file="")
+    job.refresh_from_db()
+    return job
+
+
+def run_worker(poll_interval=1.0, once=False):
+    """
+    Process queued jobs until interrupted, sleeping ``poll_interval``
+    seconds whenever the queue is empty. With ``once`` the worker returns
+    as soon as the queue is drained.
+    """
+    while True:
+        close_old_connections()
+        job = claim_job()
+        if job is not None:
+            logger.info("Running import job %s", job.id)
+            run_job(job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
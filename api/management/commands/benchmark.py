@@ -0,0 +1,144 @@
+import json
+import platform
+import subprocess
+import tempfile
+from contextlib import ExitStack
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from api.benchmark import (
+    SCENARIOS,
+    SQLITE_DEFAULT_OPTIONS,
+    run_scenario,
+    seed_catalog,
+)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throw-away database with a synthetic catalog and time the API "
+        "hot paths. Prints a JSON report with throughput, p50/p99 latency, "
+        "queries per operation and peak memory of every scenario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--books", type=int, default=10000, help="Books in the catalog."
+        )
+        parser.add_argument(
+            "--history", type=int, default=20, help="Storing rows per book."
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per API scenario."
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Threads sending leftover adjustments.",
+        )
+        parser.add_argument(
+            "--import-rows", type=int, default=10000, help="Rows per import file."
+        )
+        parser.add_argument(
+            "--imports", type=int, default=1, help="Imports per import scenario."
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="Run only this scenario; can be repeated.",
+        )
+        parser.add_argument(
+            "--no-memory",
+            dest="memory",
+            action="store_false",
+            help="Skip the peak memory measurement.",
+        )
+        parser.add_argument(
+            "--sqlite-defaults",
+            action="store_true",
+            help="Run SQLite with its default settings instead of the tuned ones.",
+        )
+        parser.add_argument(
+            "--no-pool",
+            dest="pool",
+            action="store_false",
+            help="Connect to the database anew for every request.",
+        )
+        parser.add_argument("--output", help="Write the report to this file.")
+
+    def handle(self, *args, **options):
+        names = options["scenario"] or list(SCENARIOS)
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "date": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "books": options["books"],
+                "history": options["history"],
+                "sqlite_defaults": options["sqlite_defaults"],
+                "pool": options["pool"],
+            },
+            "scenarios": {},
+        }
+
+        with tempfile.TemporaryDirectory() as directory, ExitStack() as cleanup:
+            if not options["pool"]:
+                # Shared with the connections of the other threads.
+                connection.settings_dict["OPTIONS"] = {
+                    name: value
+                    for name, value in connection.settings_dict["OPTIONS"].items()
+                    if name != "pool"
+                }
+            if connection.vendor == "sqlite":
+                # On disk, so that concurrent requests really contend for it.
+                connection.settings_dict["TEST"]["NAME"] = str(
+                    Path(directory) / "benchmark.sqlite3"
+                )
+                if options["sqlite_defaults"]:
+                    # Shared with the connections of the other threads.
+                    connection.settings_dict["OPTIONS"] = SQLITE_DEFAULT_OPTIONS
+            # Only the primary is recreated: keep every query on it.
+            cleanup.enter_context(override_settings(DATABASE_REPLICAS=[]))
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                self.stderr.write(
+                    f"Seeding {options['books']} books with "
+                    f"{options['history']} history rows each..."
+                )
+                seed_catalog(options["books"], options["history"])
+                options["cleanup"] = cleanup
+                for name in names:
+                    self.stderr.write(f"Running {name}...")
+                    report["scenarios"][name] = run_scenario(SCENARIOS[name], options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n")
+        else:
+            self.stdout.write(output)
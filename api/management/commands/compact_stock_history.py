@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.compaction import compact_history
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold Storing history older than the retention horizon into per-book "
+        "snapshots, optionally archiving the raw rows. Meant to be scheduled, "
+        "e.g. nightly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "STOCK_HISTORY_RETENTION_DAYS", 365),
+            help="Keep the raw history of this many days.",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            default=getattr(settings, "STOCK_HISTORY_ARCHIVE_DIR", None),
+            help="Write the compacted rows to a gzipped CSV file in this directory.",
+        )
+        parser.add_argument(
+            "--no-archive",
+            action="store_true",
+            help="Do not archive the compacted rows.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Rows per batch."
+        )
+
+    def handle(self, *args, **options):
+        horizon = timezone.now() - timedelta(days=options["days"])
+        archive_dir = None if options["no_archive"] else options["archive_dir"]
+
+        result = compact_history(horizon, archive_dir, options["batch_size"])
+
+        self.stdout.write(
+            f"Compacted history before {horizon.isoformat()}: "
+            f"{result['deleted']} row(s) deleted, "
+            f"{result['snapshots']} snapshot(s) written."
+        )
+        if result["archive"]:
+            self.stdout.write(f"Archived to {result['archive']}.")
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.stock import create_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Checkpoint the stock balance of every book so that point-in-time "
+        "queries only add up the history after the checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--at",
+            help=(
+                "ISO 8601 moment of the snapshot, at least "
+                "STOCK_SNAPSHOT_MARGIN_SECONDS ago (default: that long ago)."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Books per batch."
+        )
+
+    def handle(self, *args, **options):
+        # Storing rows are dated when they are created, before their
+        # transaction commits. A snapshot of a moment so recent that such
+        # rows may still be uncommitted would miss them for good.
+        margin = getattr(settings, "STOCK_SNAPSHOT_MARGIN_SECONDS", 900)
+        latest = timezone.now() - timedelta(seconds=margin)
+        at = latest
+        if options["at"]:
+            at = parse_datetime(options["at"])
+            if at is None:
+                raise CommandError(f"Invalid --at value: {options['at']}")
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            if at > latest:
+                raise CommandError(
+                    f"--at must be at least {margin} seconds in the past, so that "
+                    "no transaction still adds history before it."
+                )
+
+        count = create_snapshots(at, batch_size=options["batch_size"])
+        self.stdout.write(f"Snapshot of {count} book(s) at {at.isoformat()}.")
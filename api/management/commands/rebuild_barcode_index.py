@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the trigram index used by barcode substring searches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Books indexed per batch."
+        )
+
+    def handle(self, *args, **options):
+        rebuild_index(options["batch_size"])
+        self.stdout.write("Barcode index rebuilt.")
@@ -0,0 +1,47 @@
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued bulk storage imports with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=2, help="Number of worker threads."
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        def work():
+            try:
+                run_worker(options["poll_interval"], options["once"])
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, daemon=True)
+            for _ in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} import worker(s).")
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping import workers.")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api.routers import copy_sqlite_database, get_replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the replicas in "
+        "DATABASE_REPLICAS. Schedule it as often as the replicas may lag."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--replica",
+            action="append",
+            help="Copy only to this replica alias; can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError(
+                f"Replicas of {primary.vendor} databases are kept in sync by the "
+                "database's own replication."
+            )
+        replicas = options["replica"] or get_replicas()
+        unknown = set(replicas) - set(get_replicas())
+        if unknown:
+            raise CommandError(f"Unknown replicas: {', '.join(sorted(unknown))}.")
+
+        for alias in replicas:
+            replica = connections[alias]
+            # Reopened on its next query, on the new copy.
+            replica.close()
+            copy_sqlite_database(primary, replica.settings_dict["NAME"])
+            self.stdout.write(f"Copied the primary database to {alias}.")
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2026-10-17 17:20
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def backfill_stock_balance(apps, schema_editor):
+    """
+    Set every book balance to the total of its Storing history.
+    """
+    Storing = apps.get_model("api", "Storing")
+    BooksLeftOver = apps.get_model("api", "BooksLeftOver")
+
+    totals = Storing.objects.values("book_id").annotate(total=Sum("quantity"))
+    for row in totals.iterator():
+        BooksLeftOver.objects.update_or_create(
+            book_id=row["book_id"], defaults={"quantity": row["total"]}
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0005_importjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stock_balance, migrations.RunPython.noop),
+    ]
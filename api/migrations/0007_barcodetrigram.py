@@ -0,0 +1,48 @@
+# Generated by Django 4.2.9 on 2026-10-17 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_barcodes(apps, schema_editor):
+    """
+    Build the trigram index for the existing books.
+    """
+    Book = apps.get_model("api", "Book")
+    BarcodeTrigram = apps.get_model("api", "BarcodeTrigram")
+
+    grams = []
+    for book_id, barcode in Book.objects.exclude(barcode=None).values_list(
+        "id", "barcode"
+    ).iterator():
+        barcode = barcode.lower()
+        grams.extend(
+            BarcodeTrigram(book_id=book_id, gram=gram)
+            for gram in {barcode[i : i + 3] for i in range(len(barcode) - 2)}
+        )
+        if len(grams) >= 5000:
+            BarcodeTrigram.objects.bulk_create(grams)
+            grams = []
+    BarcodeTrigram.objects.bulk_create(grams)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_backfill_stock_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BarcodeTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='barcode_trigrams', to='api.book')),
+            ],
+            options={
+                'unique_together': {('gram', 'book')},
+            },
+        ),
+        migrations.RunPython(index_barcodes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-17 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_barcodetrigram'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storing',
+            index=models.Index(fields=['book', 'date'], name='storing_book_date_idx'),
+        ),
+    ]
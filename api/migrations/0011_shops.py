@@ -0,0 +1,80 @@
+# Generated by Django 4.2.9 on 2026-10-17 17:31
+
+import api.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_default_shop(apps, schema_editor):
+    """
+    Create the shop that all existing history and balances belong to.
+    """
+    Shop = apps.get_model("api", "Shop")
+    Shop.objects.get_or_create(
+        id=getattr(settings, "DEFAULT_SHOP_ID", 1), defaults={"name": "Main"}
+    )
+
+
+def backfill_shop_stock(apps, schema_editor):
+    """
+    Copy every book balance to the default shop.
+    """
+    BooksLeftOver = apps.get_model("api", "BooksLeftOver")
+    ShopStock = apps.get_model("api", "ShopStock")
+
+    shop_id = getattr(settings, "DEFAULT_SHOP_ID", 1)
+    leftovers = BooksLeftOver.objects.values_list("book_id", "quantity")
+    batch = []
+    for book_id, quantity in leftovers.iterator(chunk_size=5000):
+        batch.append(ShopStock(shop_id=shop_id, book_id=book_id, quantity=quantity))
+        if len(batch) == 5000:
+            ShopStock.objects.bulk_create(batch)
+            batch = []
+    ShopStock.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.RunPython(create_default_shop, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ShopStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_stock', to='api.book')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='api.shop')),
+            ],
+            options={
+                'unique_together': {('shop', 'book')},
+            },
+        ),
+        migrations.AddField(
+            model_name='storing',
+            name='shop',
+            field=models.ForeignKey(default=api.models.default_shop_id, on_delete=django.db.models.deletion.PROTECT, related_name='store_history', to='api.shop'),
+        ),
+        migrations.AddIndex(
+            model_name='storing',
+            index=models.Index(fields=['shop', 'book', 'date'], name='storing_shop_book_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.shop'),
+        ),
+        migrations.RunPython(backfill_shop_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.9 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryCompaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('horizon', models.DateTimeField()),
+                ('deleted', models.PositiveIntegerField()),
+                ('date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.db import models
 from datetime import date
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
 
+def default_shop_id():
+    return getattr(settings, "DEFAULT_SHOP_ID", 1)
+
+
 def validate_birth_date(value):
     if value <= date(1900, 1, 1):
         raise ValidationError(_("Birth date must be greater than 01/01/1900."))
@@ -17,6 +22,7 @@ def validate_publish_year(value):
 class Author(models.Model):
     name = models.CharField(max_length=255)
     birth_date = models.DateField(validators=[validate_birth_date])
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = (
@@ -30,17 +36,130 @@ class Book(models.Model):
     title = models.CharField(max_length=255, null=False, blank=False)
     publish_year = models.PositiveIntegerField(validators=[validate_publish_year])
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class BarcodeTrigram(models.Model):
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="barcode_trigrams"
+    )
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = (
+            "gram",
+            "book",
+        )
 
 
 class BooksLeftOver(models.Model):
     book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name="books")
     quantity = models.IntegerField()
     date = models.DateTimeField(auto_now_add=True)
+    # Also bumped by the queryset updates that change the balance or history.
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Shop(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+
+class ShopStock(models.Model):
+    """
+    Balance of a book in one shop. The shop balances of a book always add
+    up to its ``BooksLeftOver.quantity``.
+    """
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name="stock")
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="shop_stock")
+    quantity = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (
+            "shop",
+            "book",
+        )
 
 
 class Storing(models.Model):
     book = models.ForeignKey(
         Book, on_delete=models.CASCADE, related_name="store_history"
     )
+    shop = models.ForeignKey(
+        Shop,
+        on_delete=models.PROTECT,
+        default=default_shop_id,
+        related_name="store_history",
+    )
     quantity = models.IntegerField()
     date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["book", "date"], name="storing_book_date_idx"),
+            models.Index(
+                fields=["shop", "book", "date"], name="storing_shop_book_date_idx"
+            ),
+        ]
+
+
+class ImportJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    file = models.FileField(upload_to="imports/")
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Bumped by the worker while it runs the job; a running job without a
+    # recent heartbeat lost its worker and is claimed again.
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    # Chunks saved so far, skipped when the job is claimed again.
+    chunks_done = models.PositiveIntegerField(default=0)
+
+
+class StockSnapshot(models.Model):
+    """
+    Balance of a book at ``date``, i.e. the total of its Storing rows dated
+    before it. Point-in-time queries start from the latest snapshot and
+    only add up the rows after it.
+    """
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="stock_snapshots"
+    )
+    date = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = (
+            "book",
+            "date",
+        )
+
+
+class HistoryCompaction(models.Model):
+    """
+    A run of ``compact_history``: the Storing rows dated before ``horizon``
+    were deleted, so balances before it can no longer be worked out.
+    """
+
+    horizon = models.DateTimeField()
+    deleted = models.PositiveIntegerField()
+    date = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,105 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+
+def get_found_count(queryset):
+    """
+    Count the rows of a queryset, caching the result for
+    ``API_COUNT_CACHE_TIMEOUT`` seconds when it is set.
+    """
+    timeout = getattr(settings, "API_COUNT_CACHE_TIMEOUT", 0)
+    if not timeout:
+        return queryset.count()
+
+    sql = str(queryset.order_by().query)
+    key = "api:found:" + hashlib.md5(sql.encode()).hexdigest()
+    found = cache.get(key)
+    if found is None:
+        found = queryset.count()
+        cache.set(key, found, timeout)
+    return found
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination on ``id`` for the catalog list endpoints.
+
+    Views can define ``get_cursor_ordering()`` to paginate on another unique
+    field. Pages are returned as ``{"found", "next", "previous", "items"}``.
+    """
+
+    page_size = getattr(settings, "API_PAGE_SIZE", 100)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", 1000)
+    ordering = "id"
+    found = None
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, "get_cursor_ordering"):
+            return (view.get_cursor_ordering(),)
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # A paginator serves one request: the rows were already counted if
+        # get_page_version() paged the same queryset first.
+        if self.found is None:
+            self.found = get_found_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_version(self, queryset, request, view, stamps):
+        """
+        Version of the requested page for conditional GET: the ``found``
+        count, whether pages follow or precede it and the ordering field and
+        ``stamps`` of each of its rows. Unlike an aggregate over the whole
+        queryset this only reads one page of rows.
+        """
+        ordering = self.get_ordering(request, queryset, view)
+        fields = sorted({field.lstrip("-") for field in ordering})
+        rows = self.paginate_queryset(
+            queryset.values(*fields, *stamps), request, view
+        )
+        return [
+            self.found,
+            self.has_next,
+            self.has_previous,
+            # As strings, so lists get no Last-Modified: deletions leave the
+            # newest stamp as it was, and it only has a one-second resolution.
+            *(str(value) for row in rows for value in row.values()),
+        ]
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "found": self.found,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "items": data,
+            }
+        )
+
+
+class HistoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination of a book's Storing history, newest first.
+    """
+
+    page_size = getattr(settings, "HISTORY_PAGE_SIZE", 100)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", 1000)
+    ordering = ("-date", "-id")
+
+
+class LedgerPagination(LimitOffsetPagination):
+    """
+    Offset pagination for running-balance ledgers.
+
+    Offsets are applied after the window function that computes the running
+    balance, where a keyset filter would change the result.
+    """
+
+    default_limit = getattr(settings, "HISTORY_PAGE_SIZE", 100)
+    max_limit = getattr(settings, "API_MAX_PAGE_SIZE", 1000)
@@ -0,0 +1,11 @@
+"""
+Limits of the stock quantities of imports.
+
+Kept free of Django, pandas and NumPy so that both the text import and the
+Excel parse workers can use them.
+"""
+
+# Range of the IntegerField quantities are stored in; larger values would
+# wrap around when converted to int64 or be rejected by the database.
+MIN_QUANTITY = -(2**31)
+MAX_QUANTITY = 2**31 - 1
@@ -0,0 +1,174 @@
+"""
+Routing of reads to replicas and writes to the primary database.
+
+``PrimaryReplicaRouter`` sends every write to ``default``, the primary, and
+spreads reads over the aliases in ``DATABASE_REPLICAS``. All the reads of a
+``use_replica()`` block, e.g. of a request through
+``ReplicaRoutingMiddleware``, go to the same replica, so that they see one
+state of the database even though replicas lag behind by different
+amounts. Reads go to the
+primary instead while it is pinned, i.e. inside a transaction on it, in a
+``use_primary()`` block, or during a request of a client that wrote less
+than ``REPLICA_STICKY_SECONDS`` ago. ``ReplicaRoutingMiddleware`` pins the
+requests with an unsafe method and, through a cookie holding the end of
+the window, the client's following requests, so that clients read their own
+writes even while the replicas lag behind.
+"""
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = "db_primary_until"
+
+_pinned = ContextVar("pinned_to_primary", default=False)
+_replica = ContextVar("replica", default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+def get_sticky_seconds():
+    return getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+
+
+def pinned_to_primary():
+    return _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def reads_from_primary():
+    """
+    Whether the reads of the current context go to the primary.
+    """
+    return not get_replicas() or pinned_to_primary()
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary in the block.
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def use_replica():
+    """
+    Send all the replica reads in the block to one replica, picked at
+    random.
+    """
+    replicas = get_replicas()
+    token = _replica.set(random.choice(replicas) if replicas else None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        replica = _replica.get()
+        if replica in replicas:
+            return replica
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary; they are not migrated.
+        return db not in get_replicas()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Pin requests with an unsafe method, and the requests of the same client
+    for ``REPLICA_STICKY_SECONDS`` after them, to the primary database, and
+    send the reads of every other request to a single replica.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    unsafe_methods = {"POST", "PUT", "PATCH", "DELETE"}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_pin(request):
+            with use_replica():
+                return self.get_response(request)
+        with use_primary():
+            response = self.get_response(request)
+        return self.stick(request, response)
+
+    async def __acall__(self, request):
+        if not self.should_pin(request):
+            with use_replica():
+                return await self.get_response(request)
+        with use_primary():
+            response = await self.get_response(request)
+        return self.stick(request, response)
+
+    def should_pin(self, request):
+        if not get_replicas():
+            return False
+        if request.method in self.unsafe_methods:
+            return True
+        try:
+            return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def stick(self, request, response):
+        """
+        Keep the client on the primary for a while after a successful write.
+        """
+        seconds = get_sticky_seconds()
+        if request.method in self.unsafe_methods and response.status_code < 400:
+            if seconds > 0:
+                response.set_cookie(
+                    PRIMARY_COOKIE,
+                    f"{time.time() + seconds:.3f}",
+                    max_age=seconds,
+                    httponly=True,
+                    samesite="Lax",
+                )
+        return response
+
+
+def copy_sqlite_database(source, path):
+    """
+    Copy the SQLite database of the ``source`` connection to ``path`` with
+    SQLite's online backup, which is consistent even while it is written.
+    """
+    source.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        source.connection.backup(target)
+    finally:
+        target.close()
@@ -0,0 +1,94 @@
+"""
+Barcode search.
+
+Exact and prefix searches are answered from the unique index on
+``Book.barcode``. Substring searches first narrow the books down with the
+``BarcodeTrigram`` table, which holds every distinct lower-cased
+three-character slice of every barcode, and only check ``icontains`` on
+the candidates.
+"""
+from django.db.models import Count
+
+from .models import BarcodeTrigram, Book
+from .routers import use_primary
+
+GRAM_SIZE = 3
+
+MATCH_EXACT = "exact"
+MATCH_PREFIX = "prefix"
+MATCH_CONTAINS = "contains"
+MATCH_MODES = (MATCH_EXACT, MATCH_PREFIX, MATCH_CONTAINS)
+
+# Sorts after every character, so [prefix, prefix + PREFIX_END) is the range
+# of strings starting with prefix.
+PREFIX_END = "\U0010ffff"
+
+
+def barcode_grams(barcode):
+    """
+    Return the set of lower-cased trigrams of a barcode.
+    """
+    barcode = (barcode or "").lower()
+    return {
+        barcode[i : i + GRAM_SIZE] for i in range(len(barcode) - GRAM_SIZE + 1)
+    }
+
+
+def index_barcodes(books):
+    """
+    Rebuild the trigram rows of the given books, e.g. after they were saved
+    or bulk inserted.
+    """
+    books = list(books)
+    if not books:
+        return
+    BarcodeTrigram.objects.filter(book__in=books).delete()
+    BarcodeTrigram.objects.bulk_create(
+        [
+            BarcodeTrigram(book_id=book.id, gram=gram)
+            for book in books
+            for gram in barcode_grams(book.barcode)
+        ]
+    )
+
+
+def search_books(queryset, term, match=MATCH_CONTAINS):
+    """
+    Filter a Book queryset down to the books whose barcode matches ``term``.
+    """
+    if match == MATCH_EXACT:
+        return queryset.filter(barcode=term)
+    if match == MATCH_PREFIX:
+        # A range instead of LIKE so every database can use the index.
+        return queryset.filter(barcode__gte=term, barcode__lt=term + PREFIX_END)
+
+    grams = barcode_grams(term)
+    if grams:
+        candidates = (
+            BarcodeTrigram.objects.filter(gram__in=grams)
+            .values("book_id")
+            .annotate(matched=Count("gram"))
+            .filter(matched=len(grams))
+            .values("book_id")
+        )
+        queryset = queryset.filter(id__in=candidates)
+    return queryset.filter(barcode__icontains=term)
+
+
+def rebuild_index(batch_size=5000):
+    """
+    Re-index every book, ``batch_size`` books at a time.
+    """
+    # A replica that lags behind would leave recent books unindexed.
+    with use_primary():
+        BarcodeTrigram.objects.all().delete()
+        books = (
+            Book.objects.exclude(barcode=None).only("id", "barcode").order_by("id")
+        )
+        last_id = 0
+        while True:
+            batch = list(books.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return
+            index_barcodes(batch)
+            last_id = batch[-1].id
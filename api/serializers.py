@@ -1,8 +1,44 @@
-import pandas as pd
-
 from django.forms import ValidationError
 from rest_framework import serializers
-from .models import Author, Book, BooksLeftOver, Storing
+from django.utils import timezone
+from .exports import EXPORT_FORMATS
+from .instrumentation import serializing
+from .models import Author, Book, BooksLeftOver, ImportJob, Shop, Storing
+from .stock import get_history_horizon
+from .utils import handle_excel, handle_text
+
+
+def check_history_horizon(attrs, *fields):
+    """
+    Reject the moments in ``fields`` that lie before the compacted history,
+    where balances are no longer known.
+    """
+    moments = {field: attrs[field] for field in fields if attrs.get(field)}
+    if not moments:
+        return
+    horizon = get_history_horizon()
+    if horizon is None:
+        return
+    errors = {
+        field: [
+            f"The history before {horizon.isoformat()} was compacted; "
+            "balances before it are not available."
+        ]
+        for field, moment in moments.items()
+        if moment < horizon
+    }
+    if errors:
+        raise serializers.ValidationError(errors)
+
+
+class TimedSerializerMixin:
+    """
+    Count ``to_representation`` towards the ``serialize_ms`` of the request.
+    """
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
 
 
 class CreateAuthorSerializer(serializers.ModelSerializer):
@@ -31,7 +67,7 @@ class CreateAuthorSerializer(serializers.ModelSerializer):
         return representation
 
 
-class GetAuthorDetailsSerializer(serializers.ModelSerializer):
+class GetAuthorDetailsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for retrieving specific details of Author instances.
     """
@@ -51,7 +87,7 @@ class CreateBookSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class BookDetailsSerializer(serializers.ModelSerializer):
+class BookDetailsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for retrieving detailed information about Book instances.
 
@@ -66,8 +102,14 @@ class BookDetailsSerializer(serializers.ModelSerializer):
         fields = ["title", "publish_year", "author", "barcode", "quantity"]
 
     def get_quantity(self, instance):
-        quantity = instance.store_history.filter(book_id=instance.id).last()
-        return quantity.quantity if quantity is not None else 0
+        """
+        Current stock balance, read from the book's BooksLeftOver row.
+
+        Querysets should ``select_related("books")`` so that this does not
+        cost a query per book.
+        """
+        leftover = getattr(instance, "books", None)
+        return leftover.quantity if leftover is not None else 0
 
 
 class CreateStorageSerializer(serializers.ModelSerializer):
@@ -86,56 +128,82 @@ class CreateStorageSerializer(serializers.ModelSerializer):
         return representation
 
 
-class GetHistorySerializer(serializers.ModelSerializer):
+class HistoryFilterSerializer(serializers.Serializer):
     """
-    Serializer for retrieving the history of Book instances.
+    Serializer for the date range of a history request.
 
-    Includes information about the book and its storing history.
+    ``date_from`` is inclusive and ``date_to`` exclusive; both take an ISO
+    8601 datetime or a plain date, meaning midnight.
     """
 
-    book = serializers.SerializerMethodField()
-    history = serializers.SerializerMethodField()
-    start_balance = serializers.SerializerMethodField()
-    end_balance = serializers.SerializerMethodField()
+    date_from = serializers.DateTimeField(
+        required=False, input_formats=["iso-8601", "%Y-%m-%d"]
+    )
+    date_to = serializers.DateTimeField(
+        required=False, input_formats=["iso-8601", "%Y-%m-%d"]
+    )
 
-    class Meta:
-        model = Book
-        fields = ["book", "start_balance", "end_balance", "history"]
+    def validate(self, attrs):
+        date_from, date_to = attrs.get("date_from"), attrs.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError("date_from must not be after date_to.")
+        check_history_horizon(attrs, "date_from", "date_to")
+        return attrs
 
-    def get_book(self, obj):
-        """
-        Get the serialized representation of the book.
 
-        Args:
-            obj: The Book instance.
+class ShopHistoryFilterSerializer(HistoryFilterSerializer):
+    """
+    Serializer for the date range of a history request, optionally limited
+    to one shop.
+    """
 
-        Returns:
-            dict: The serialized representation of the book.
-        """
-        return {"key": obj.id, "title": obj.title}
+    shop = serializers.PrimaryKeyRelatedField(
+        queryset=Shop.objects.all(), required=False
+    )
 
-    def get_start_balance(self, obj):
-        return obj.store_history.first().quantity
 
-    def get_end_balance(self, obj):
-        return obj.store_history.latest("id").quantity
+class ExportSerializer(serializers.Serializer):
+    """
+    Serializer for the query of an export request.
+    """
 
-    def get_history(self, obj):
-        """
-        Get the serialized representation of the storing history.
+    format = serializers.ChoiceField(choices=EXPORT_FORMATS, default="csv")
 
-        Args:
-            obj: The Book instance.
 
-        Returns:
-            list: List of dictionaries representing the storing history.
-        """
-        information_history = obj.store_history.all().order_by("-date")
-        history_list = [
-            {"date": entry.date, "quantity": entry.quantity}
-            for entry in information_history
-        ]
-        return history_list
+class HistoryExportSerializer(ExportSerializer, ShopHistoryFilterSerializer):
+    """
+    Serializer for the query of a history export: the format, the date range
+    and optionally one book and shop.
+    """
+
+    book = serializers.IntegerField(required=False)
+
+
+class StockAtSerializer(serializers.Serializer):
+    """
+    Serializer for the query of a point-in-time stock request.
+
+    ``at`` defaults to now; without ``barcode`` every book is listed.
+    """
+
+    at = serializers.DateTimeField(
+        required=False, input_formats=["iso-8601", "%Y-%m-%d"]
+    )
+    barcode = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        check_history_horizon(attrs, "at")
+        return attrs
+
+
+class ShopSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for listing and creating Shop instances.
+    """
+
+    class Meta:
+        model = Shop
+        fields = ["id", "name"]
 
 
 class CreateBooksLeftOverSerializer(serializers.ModelSerializer):
@@ -148,6 +216,38 @@ class CreateBooksLeftOverSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ImportJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for reporting the progress of a background import job.
+    """
+
+    job_id = serializers.IntegerField(source="id")
+    throughput = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            "job_id",
+            "status",
+            "rows_processed",
+            "rows_failed",
+            "throughput",
+            "errors",
+            "created",
+            "started",
+            "finished",
+        ]
+
+    def get_throughput(self, obj):
+        """
+        Rows processed per second since the job started.
+        """
+        if obj.started is None:
+            return 0
+        elapsed = ((obj.finished or timezone.now()) - obj.started).total_seconds()
+        return round(obj.rows_processed / elapsed, 2) if elapsed > 0 else 0
+
+
 class BulkCreateStorageSerializer(serializers.Serializer):
     file = serializers.FileField()
 
@@ -174,98 +274,15 @@ class BulkCreateStorageSerializer(serializers.Serializer):
 
     def handle_excel(self, file):
         try:
-            df = pd.read_excel(file)
-            df["is_null"] = df["quantity"].isnull()
-
+            result = handle_excel(file)
         except Exception as e:
             raise serializers.ValidationError(f"Error reading Excel file: {str(e)}")
 
-        errors = []  # List to store validation errors
-
-        for index, row in df.iterrows():
-            barcode, quantity, is_null = (
-                row.get("barcode", ""),
-                row.get("quantity", ""),
-                row.get("is_null"),
-            )
-
-            if not barcode:
-                continue
-
-            try:
-                if is_null:
-                    errors.append(
-                        f"Error at row {index + 2}. Quantity cannot be blank."
-                    )
-                else:
-                    quantity = int(quantity)
-                    book_obj = Book.objects.get(barcode=barcode)
-
-                    if not book_obj:
-                        errors.append(
-                            f"Error at row {index + 2}. Book with barcode: {barcode} does not exist"
-                        )
-                    else:
-                        Storing.objects.create(book=book_obj, quantity=quantity)
-
-            except ValueError:
-                errors.append(
-                    f"Invalid quantity at row {index + 2}. Quantity must be a number."
-                )
-
-        self.handle_errors(errors)
+        self.handle_errors(result)
 
     def handle_text(self, file):
-        errors = []  # List to store validation errors
-
-        lines = file.readlines()
-
-        for line_number, line_bytes in enumerate(lines):
-            line = line_bytes.strip()
-
-            if line.startswith(b"BRC"):
-                barcode = line[3:].decode("utf-8")
-
-                if line_number + 1 < len(lines):
-                    quantity_line_bytes = lines[line_number + 1]
-                    quantity_line = quantity_line_bytes.strip()
-                else:
-                    errors.append(
-                        f"Missing quantity line for barcode at line {line_number + 1}."
-                    )
-                    continue
-
-                if not quantity_line.startswith(b"QNT"):
-                    errors.append(f"Missing quantity at line {line_number + 2}.")
-                    continue
-
-                quantity = quantity_line[3:].decode("utf-8")
-                self.process_text_line(barcode, quantity, line_number, errors)
-
-        self.handle_errors(errors)
-
-    def process_text_line(self, barcode, quantity, line_number, errors):
-        if not barcode:
-            return
-
-        try:
-            book_obj = Book.objects.get(barcode=barcode)
-        except Book.DoesNotExist:
-            errors.append(
-                f"Book with barcode '{barcode}' not found at line {line_number + 1}."
-            )
-            return
-
-        try:
-            quantity = int(quantity)
-            Storing.objects.create(book=book_obj, quantity=quantity)
-        except ValueError:
-            errors.append(
-                f"Invalid quantity at line {line_number + 2}. Quantity must be a number."
-            )
-        except Exception as e:
-            errors.append(f"Error saving data at line {line_number + 1}: {str(e)}")
+        self.handle_errors(handle_text(file))
 
     def handle_errors(self, errors):
-        if errors:
+        if errors is not True:
             raise serializers.ValidationError({"non_field_errors": errors})
@@ -1,18 +1,50 @@
-from django.db.models.signals import pre_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import BooksLeftOver, Storing
+from .cache import invalidate, invalidate_books
+from .instrumentation import install_query_timer
+from .models import Author, Book, BooksLeftOver, Storing
+from .search import index_barcodes
 
 
-@receiver(pre_save, sender=BooksLeftOver)
-def create_storing_entry(sender, instance, **kwargs):
+@receiver(post_save, sender=Book)
+def index_book_barcode(sender, instance, update_fields=None, **kwargs):
     """
-    Signal to create a Storing entry when a BooksLeftOver entry is created.
+    Signal to keep the barcode trigram index in sync when a Book is saved.
     """
-    # update history
-    prev_instance = BooksLeftOver.objects.get(id=instance.id)
-    if prev_instance.quantity < instance.quantity:
-        quantity = instance.quantity - prev_instance.quantity
-    else:
-        quantity = -abs(prev_instance.quantity - instance.quantity)
+    if update_fields is not None and "barcode" not in update_fields:
+        return
+    index_barcodes([instance])
 
-    Storing.objects.create(book=instance.book, quantity=quantity)
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BooksLeftOver)
+@receiver(post_delete, sender=BooksLeftOver)
+@receiver(post_save, sender=Storing)
+def invalidate_book_responses(sender, instance, **kwargs):
+    """
+    Signal to drop the cached responses showing a saved or deleted book, its
+    balance or its history. Bulk writes invalidate in ``api.stock``.
+    """
+    book_id = instance.id if sender is Book else instance.book_id
+    invalidate_books([book_id])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_responses(sender, instance, **kwargs):
+    """
+    Signal to drop the cached responses showing a saved or deleted author,
+    including the details of all books, which embed their author.
+    """
+    invalidate(f"author:{instance.id}", "author-list", "books-all")
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    """
+    Signal to count the queries of every new connection, in any thread, for
+    the request instrumentation.
+    """
+    install_query_timer(connection)
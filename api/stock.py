@@ -0,0 +1,282 @@
+"""
+Bookkeeping of the current stock balance of every book.
+
+``BooksLeftOver.quantity`` holds the running total of a book's ``Storing``
+rows. Both are always written together in one transaction: leftover
+adjustments go through ``adjust_leftover``, and code that creates
+``Storing`` rows directly goes through ``record_storing``.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    DateTimeField,
+    Exists,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+    Window,
+)
+from django.db.models.functions import Coalesce
+
+from .cache import invalidate_books
+from .models import (
+    Book,
+    BooksLeftOver,
+    HistoryCompaction,
+    ShopStock,
+    StockSnapshot,
+    Storing,
+    default_shop_id,
+)
+from .routers import use_primary
+
+# Stands in for "no snapshot yet": every Storing row is after it.
+BEGINNING = datetime(1900, 1, 1, tzinfo=timezone.utc)
+
+
+def add_to_balances(model, deltas, now, **scope):
+    """
+    Add ``(book_id, delta)`` pairs to the ``quantity`` of the ``model`` rows
+    of the books in ``scope``, creating missing rows, with one UPDATE per
+    batch of books.
+    """
+    model.objects.bulk_create(
+        [model(book_id=book_id, quantity=0, **scope) for book_id, _ in deltas],
+        ignore_conflicts=True,
+    )
+
+    # Every book costs three parameters: the IN list entry and its WHEN.
+    batch_size = (connection.features.max_query_params or 999) // 3
+    for start in range(0, len(deltas), batch_size):
+        batch = deltas[start : start + batch_size]
+        model.objects.filter(
+            book_id__in=[book_id for book_id, _ in batch], **scope
+        ).update(
+            quantity=F("quantity")
+            + Case(
+                *[When(book_id=book_id, then=Value(delta)) for book_id, delta in batch],
+                default=Value(0),
+            ),
+            updated_at=now,
+        )
+
+
+def apply_stock_deltas(deltas, shop_id=None):
+    """
+    Add ``{book_id: delta}`` to the balances of the given books, in total
+    and in the shop (by default ``DEFAULT_SHOP_ID``), creating missing
+    balance rows.
+
+    Zero deltas are applied too: they come from new history rows, e.g. ones
+    that cancel out, so the books' cached responses and ``updated_at``
+    versions must change all the same.
+    """
+    deltas = list(deltas.items())
+    if not deltas:
+        return
+    invalidate_books(book_id for book_id, _ in deltas)
+
+    shop_id = default_shop_id() if shop_id is None else shop_id
+    now = datetime.now(timezone.utc)
+    add_to_balances(BooksLeftOver, deltas, now)
+    add_to_balances(ShopStock, deltas, now, shop_id=shop_id)
+
+
+def record_storing(store_list, batch_size=None, shop_id=None):
+    """
+    Save new Storing rows and add them to the book and shop balances
+    atomically. ``shop_id``, if given, overrides the shop of every row.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for storing in store_list:
+        if shop_id is not None:
+            storing.shop_id = shop_id
+        deltas[storing.shop_id][storing.book_id] += storing.quantity
+
+    with transaction.atomic():
+        Storing.objects.bulk_create(store_list, batch_size=batch_size)
+        for shop, shop_deltas in deltas.items():
+            apply_stock_deltas(shop_deltas, shop)
+
+
+def adjust_leftover(barcode, delta, shop_id=None):
+    """
+    Add ``delta`` to the balance of the book with the given barcode, in
+    total and in the shop (by default ``DEFAULT_SHOP_ID``), and record it as
+    a Storing row, all in one transaction.
+
+    The balances are changed with ``UPDATE ... SET quantity = quantity +
+    delta`` so concurrent adjustments of the same book never lose an update.
+    Raises ``Book.DoesNotExist`` for unknown barcodes.
+    """
+    shop_id = default_shop_id() if shop_id is None else shop_id
+    leftovers = BooksLeftOver.objects.filter(book__barcode=barcode)
+    changes = {
+        "quantity": F("quantity") + delta,
+        "updated_at": datetime.now(timezone.utc),
+    }
+    with transaction.atomic():
+        if not leftovers.update(**changes):
+            book_id = Book.objects.values_list("id", flat=True).get(barcode=barcode)
+            BooksLeftOver.objects.bulk_create(
+                [BooksLeftOver(book_id=book_id, quantity=0)], ignore_conflicts=True
+            )
+            leftovers.update(**changes)
+        leftover = leftovers.get()
+
+        shop_stock = ShopStock.objects.filter(shop_id=shop_id, book_id=leftover.book_id)
+        if not shop_stock.update(**changes):
+            ShopStock.objects.bulk_create(
+                [ShopStock(shop_id=shop_id, book_id=leftover.book_id, quantity=0)],
+                ignore_conflicts=True,
+            )
+            shop_stock.update(**changes)
+        Storing.objects.create(
+            book_id=leftover.book_id, shop_id=shop_id, quantity=delta
+        )
+    return leftover
+
+
+def history_balances(
+    book_id, balance, date_from=None, date_to=None, shop_id=None
+):
+    """
+    Return the ``(start_balance, end_balance)`` of a book's history window:
+    its balance just before ``date_from`` and just before ``date_to``.
+
+    Both are worked back from the current ``balance`` (of the shop, if
+    ``shop_id`` is given) by subtracting the rows after each moment, in one
+    aggregate query over the (book, date) index. Without ``date_from`` the
+    start is the balance before the oldest row still in the table (0 unless
+    the history was compacted); without ``date_to`` the end is the current
+    balance.
+    """
+    rows = Storing.objects.filter(book_id=book_id)
+    if shop_id is not None:
+        rows = rows.filter(shop_id=shop_id)
+    sums = {"after_from": Sum("quantity")}
+    if date_from is not None:
+        rows = rows.filter(date__gte=date_from)
+    if date_to is not None:
+        sums["after_to"] = Sum("quantity", filter=Q(date__gte=date_to))
+    later = rows.aggregate(**sums)
+
+    start = balance - (later["after_from"] or 0)
+    end = balance - (later.get("after_to") or 0)
+    return start, end
+
+
+def get_history_horizon():
+    """
+    Return the latest horizon the history was compacted up to, or None.
+    The rows before it are gone, so balances before it are unknown.
+    """
+    return HistoryCompaction.objects.aggregate(horizon=Max("horizon"))["horizon"]
+
+
+def balances_at(moment, books=None):
+    """
+    Annotate books with their ``quantity`` just before ``moment``.
+
+    Each balance is the latest snapshot taken at or before ``moment`` plus
+    the Storing rows between the two, so the cost is bounded by the rows
+    since the last snapshot rather than by the whole history.
+    """
+    books = Book.objects.all() if books is None else books
+    snapshots = StockSnapshot.objects.filter(
+        book=OuterRef("pk"), date__lte=moment
+    ).order_by("-date")
+    deltas = (
+        Storing.objects.filter(
+            book=OuterRef("pk"),
+            date__gte=OuterRef("snapshot_date"),
+            date__lt=moment,
+        )
+        .order_by()
+        .values("book")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return books.annotate(
+        snapshot_date=Coalesce(
+            Subquery(snapshots.values("date")[:1]),
+            Value(BEGINNING, output_field=DateTimeField()),
+        ),
+        snapshot_quantity=Coalesce(
+            Subquery(snapshots.values("quantity")[:1]), Value(0)
+        ),
+    ).annotate(
+        quantity=F("snapshot_quantity")
+        + Coalesce(Subquery(deltas, output_field=IntegerField()), Value(0))
+    )
+
+
+def create_snapshots(moment, books=None, batch_size=5000):
+    """
+    Store the balance at ``moment`` of every book with history or an
+    earlier snapshot, ``batch_size`` books at a time. Existing snapshots for
+    the same moment are kept. Returns the number of books processed.
+    """
+    # Replicas may lag behind: a snapshot must see every row before it.
+    with use_primary():
+        books = Book.objects.all() if books is None else books
+        books = books.filter(
+            Exists(Storing.objects.filter(book=OuterRef("pk")))
+            | Exists(StockSnapshot.objects.filter(book=OuterRef("pk")))
+        ).order_by("id")
+        created = 0
+        last_id = 0
+        while True:
+            batch = list(
+                balances_at(moment, books.filter(id__gt=last_id)).values_list(
+                    "id", "quantity"
+                )[:batch_size]
+            )
+            if not batch:
+                return created
+            StockSnapshot.objects.bulk_create(
+                [
+                    StockSnapshot(book_id=book_id, date=moment, quantity=quantity)
+                    for book_id, quantity in batch
+                ],
+                ignore_conflicts=True,
+            )
+            created += len(batch)
+            last_id = batch[-1][0]
+
+
+def running_balances(book_id, date_from=None, date_to=None):
+    """
+    Return a book's Storing rows in ``[date_from, date_to)``, oldest first,
+    each with the ``balance`` right after it.
+
+    The running total is a window function over the rows in the range,
+    offset by the balance just before ``date_from``, or before the oldest
+    row still in the table.
+    """
+    rows = Storing.objects.filter(book_id=book_id)
+    if date_from is not None:
+        rows = rows.filter(date__gte=date_from)
+        base = balances_at(date_from, Book.objects.filter(id=book_id)).values_list(
+            "quantity", flat=True
+        ).first() or 0
+    else:
+        balance = BooksLeftOver.objects.filter(book_id=book_id).values_list(
+            "quantity", flat=True
+        ).first() or 0
+        base = balance - (rows.aggregate(total=Sum("quantity"))["total"] or 0)
+    if date_to is not None:
+        rows = rows.filter(date__lt=date_to)
+    return rows.order_by("date", "id").annotate(
+        balance=Window(Sum("quantity"), order_by=[F("date").asc(), F("id").asc()])
+        + Value(base)
+    ).values("date", "quantity", "balance")
@@ -1,8 +1,96 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import ConnectionHandler
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from openpyxl import Workbook, load_workbook
+from rest_framework.response import Response
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Author, Book, Storing
+from book_storage.db_backends.pool import ConnectionPool
+from .cache import cached_response
+from .benchmark import SCENARIOS, run_scenario, seed_catalog
+from .excel import plan_parts
+from .instrumentation import registry
+from .compaction import compact_history
+from .jobs import bump_heartbeat, claim_job, run_job
+from .routers import (
+    PRIMARY_COOKIE,
+    PrimaryReplicaRouter,
+    ReplicaRoutingMiddleware,
+    copy_sqlite_database,
+    use_primary,
+    use_replica,
+)
+from .models import (
+    Author,
+    BarcodeTrigram,
+    Book,
+    BooksLeftOver,
+    ImportJob,
+    Shop,
+    ShopStock,
+    StockSnapshot,
+    Storing,
+)
+from .search import rebuild_index
+from .stock import create_snapshots, record_storing
+from .utils import handle_excel, handle_text
 from django.urls import reverse
+from django.utils import timezone
+
+
+def make_xlsx(rows, name="stock.xlsx", sheets=None):
+    """
+    Build an in-memory .xlsx upload with a barcode/quantity header.
+    ``sheets`` maps extra sheet titles to their rows.
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Sheet1"
+    for title, sheet_rows in [("Sheet1", rows), *(sheets or {}).items()]:
+        if title != "Sheet1":
+            sheet = workbook.create_sheet(title)
+        sheet.append(["barcode", "quantity"])
+        for row in sheet_rows:
+            sheet.append(list(row))
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def add_history(book, quantity, date):
+    """
+    Record a Storing row at a given (UTC) date through the stock bookkeeping.
+    """
+    record_storing([Storing(book=book, quantity=quantity)])
+    Storing.objects.filter(id=Storing.objects.latest("id").id).update(
+        date=date.replace(tzinfo=dt_timezone.utc)
+    )
 
 
 class BookshopApiTests(TestCase):
@@ -67,3 +155,1547 @@ class BookshopApiTests(TestCase):
         response = self.client.post(url, data, format="json")
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book1 = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        self.book2 = Book.objects.create(
+            title="Book 2", publish_year=2016, author=author, barcode="222"
+        )
+        self.url = reverse("bulk-leftover")
+
+    def test_text_upload_in_chunks(self):
+        content = b"BRC111\nQNT5\nBRC222\nQNT7\nBRC111\nQNT-2\n"
+        upload = SimpleUploadedFile("stock.txt", content)
+
+        with self.settings(BULK_IMPORT_CHUNK_SIZE=1):
+            response = self.client.post(self.url, {"file": upload})
+
+        self.assertEqual(response.data, {"success": "Data uploaded successfully"})
+        self.assertEqual(
+            list(Storing.objects.order_by("id").values_list("book_id", "quantity")),
+            [(self.book1.id, 5), (self.book2.id, 7), (self.book1.id, -2)],
+        )
+
+    def test_text_quantities_out_of_range_are_rejected(self):
+        content = (
+            b"BRC111\nQNT99999999999999999999\n"
+            b"BRC111\nQNT3000000000\n"
+            b"BRC111\nQNT2\n"
+        )
+        upload = SimpleUploadedFile("stock.txt", content)
+
+        response = self.client.post(self.url, {"file": upload})
+
+        self.assertEqual(
+            response.data,
+            [
+                "Invalid quantity at line 2. Quantity must be a number.",
+                "Invalid quantity at line 4. Quantity must be a number.",
+            ],
+        )
+        self.assertEqual(list(Storing.objects.values_list("quantity", flat=True)), [2])
+
+    def test_text_upload_errors_keep_line_numbers(self):
+        content = b"BRC111\nQNTabc\nBRC999\nQNT1\nBRC222\nBRC222\nQNT3\nBRC111"
+        upload = SimpleUploadedFile("stock.txt", content)
+
+        with self.settings(BULK_IMPORT_CHUNK_SIZE=2):
+            response = self.client.post(self.url, {"file": upload})
+
+        self.assertEqual(
+            response.data,
+            [
+                "Invalid quantity at line 2. Quantity must be a number.",
+                "Book with barcode '999' not found at line 3.",
+                "Missing quantity at line 6.",
+                "Missing quantity line for barcode at line 8.",
+            ],
+        )
+        self.assertEqual(
+            list(Storing.objects.values_list("book_id", "quantity")),
+            [(self.book2.id, 3)],
+        )
+
+    def test_excel_upload_errors_keep_row_numbers(self):
+        upload = make_xlsx(
+            [(111, 4), ("222", None), (None, 1), ("333", 2), ("111", "x"), ("222", 9)]
+        )
+
+        with self.settings(BULK_IMPORT_CHUNK_SIZE=2):
+            response = self.client.post(self.url, {"file": upload})
+
+        self.assertEqual(
+            response.data,
+            [
+                "Error at row 3. Quantity cannot be blank.",
+                "Error at row 5. Book with barcode: 333 does not exist",
+                "Invalid quantity at row 6. Quantity must be a number.",
+            ],
+        )
+        self.assertEqual(
+            list(Storing.objects.order_by("id").values_list("book_id", "quantity")),
+            [(self.book1.id, 4), (self.book2.id, 9)],
+        )
+
+    def test_upload_resolves_barcodes_once_per_chunk(self):
+        content = b"".join(b"BRC%s\nQNT1\n" % code for code in [b"111", b"222"] * 50)
+        upload = SimpleUploadedFile("stock.txt", content)
+
+        # The chunk's savepoint, one barcode lookup for it, then the Storing
+        # insert and the book and shop balance upserts inside a savepoint.
+        with self.assertNumQueries(10):
+            result = handle_text(upload)
+
+        self.assertTrue(result)
+        self.assertEqual(Storing.objects.count(), 100)
+
+
+class BulkImportJobTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = self.settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_async_upload_is_processed_by_worker(self):
+        upload = SimpleUploadedFile("stock.txt", b"BRC111\nQNT5\nBRC999\nQNT1\n")
+
+        response = self.client.post(
+            reverse("bulk-leftover") + "?async=1", {"file": upload}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data["job_id"]
+        self.assertEqual(response.data["status"], ImportJob.PENDING)
+        self.assertEqual(Storing.objects.count(), 0)
+
+        job = claim_job()
+        self.assertEqual(job.id, job_id)
+        self.assertIsNone(claim_job())
+        run_job(job)
+
+        response = self.client.get(response.data["status_url"])
+        self.assertEqual(response.data["status"], ImportJob.DONE)
+        self.assertEqual(response.data["rows_processed"], 2)
+        self.assertEqual(response.data["rows_failed"], 1)
+        self.assertEqual(
+            response.data["errors"], ["Book with barcode '999' not found at line 3."]
+        )
+        self.assertEqual(Storing.objects.get().quantity, 5)
+
+    def test_stale_running_job_is_resumed(self):
+        content = b"BRC111\nQNT5\nBRC999\nQNT1\nBRC111\nQNT2\n"
+        job = ImportJob.objects.create(file=SimpleUploadedFile("stock.txt", content))
+        with self.settings(BULK_IMPORT_CHUNK_SIZE=2):
+            # A worker claims the job, saves the first chunk and dies in the
+            # second one.
+            def on_chunk(processed, messages):
+                if claimed.chunks_done:
+                    raise KeyboardInterrupt
+                claimed.chunks_done = 1
+                ImportJob.objects.filter(id=job.id).update(
+                    chunks_done=1, rows_processed=processed, errors=messages
+                )
+
+            claimed = claim_job()
+            with self.assertRaises(KeyboardInterrupt):
+                handle_text(claimed.file.open("rb"), on_chunk=on_chunk)
+            self.assertIsNone(claim_job())
+
+            ImportJob.objects.filter(id=job.id).update(
+                heartbeat=timezone.now() - timedelta(seconds=301)
+            )
+            with self.assertLogs("api.jobs", "WARNING"):
+                reclaimed = claim_job()
+            run_job(reclaimed)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 3)
+        self.assertEqual(job.errors, ["Book with barcode '999' not found at line 3."])
+        self.assertEqual(BooksLeftOver.objects.get(book=self.book).quantity, 7)
+
+    @override_settings(IMPORT_JOB_MAX_ERRORS=2, BULK_IMPORT_CHUNK_SIZE=1)
+    def test_job_keeps_a_sample_of_the_errors(self):
+        content = b"".join(b"BRC99%d\nQNT1\n" % i for i in range(4))
+        ImportJob.objects.create(file=SimpleUploadedFile("stock.txt", content))
+
+        job = run_job(claim_job())
+
+        self.assertEqual(job.rows_failed, 4)
+        self.assertEqual(
+            job.errors,
+            [
+                "Book with barcode '990' not found at line 1.",
+                "Book with barcode '991' not found at line 3.",
+            ],
+        )
+
+    def test_job_claimed_again_by_another_worker_is_left_to_it(self):
+        ImportJob.objects.create(
+            file=SimpleUploadedFile("stock.txt", b"BRC111\nQNT5\n")
+        )
+        job = claim_job()
+        # Meanwhile another worker claimed the job and saved a chunk.
+        ImportJob.objects.filter(id=job.id).update(chunks_done=1)
+
+        with self.assertLogs("api.jobs", "WARNING"):
+            run_job(job)
+
+        self.assertEqual(job.status, ImportJob.RUNNING)
+        self.assertTrue(job.file)
+        self.assertFalse(Storing.objects.exists())
+        self.assertFalse(BooksLeftOver.objects.filter(book=self.book).exists())
+
+    def test_heartbeat_errors_are_logged(self):
+        job = ImportJob.objects.create(file=SimpleUploadedFile("stock.txt", b""))
+        locked = OperationalError("database is locked")
+
+        with mock.patch.object(ImportJob.objects, "filter", side_effect=locked):
+            with self.assertLogs("api.jobs", "ERROR"):
+                bump_heartbeat(job)
+
+    def test_failed_job_reports_error(self):
+        job = ImportJob.objects.create(
+            file=SimpleUploadedFile("stock.xlsx", b"not a workbook")
+        )
+
+        with self.assertLogs("api.jobs", "ERROR"):
+            run_job(claim_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(len(job.errors), 1)
+
+
+class ParallelExcelImportTests(TestCase):
+    def setUp(self):
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book1 = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        self.book2 = Book.objects.create(
+            title="Book 2", publish_year=2016, author=author, barcode="222"
+        )
+
+    def make_workbook(self):
+        return make_xlsx(
+            [(111, 1), ("222", None), ("333", 2)],
+            sheets={"Sheet2": [("222", "x"), (None, 5), ("111", 3)]},
+        )
+
+    def test_parallel_import_matches_serial_import(self):
+        serial = handle_excel(self.make_workbook(), workers=0)
+        serial_rows = sorted(Storing.objects.values_list("book_id", "quantity"))
+        Storing.objects.all().delete()
+
+        parallel = handle_excel(self.make_workbook(), workers=2)
+
+        self.assertEqual(
+            parallel,
+            [
+                "Sheet 'Sheet1': Error at row 3. Quantity cannot be blank.",
+                "Sheet 'Sheet1': Error at row 4. Book with barcode: 333 does not exist",
+                "Sheet 'Sheet2': Invalid quantity at row 2. Quantity must be a number.",
+            ],
+        )
+        self.assertEqual(parallel, serial)
+        self.assertEqual(
+            sorted(Storing.objects.values_list("book_id", "quantity")), serial_rows
+        )
+        self.assertEqual(
+            serial_rows, [(self.book1.id, 1), (self.book1.id, 3)]
+        )
+
+    def test_out_of_range_and_non_integral_text_are_rejected(self):
+        rows = [("111", 10**20), ("111", "3.7"), ("111", "1e3"), ("111", " 4 ")]
+        for workers in [0, 2]:
+            with self.subTest(workers=workers):
+                Storing.objects.all().delete()
+                upload = make_xlsx(rows, sheets={"Sheet2": [("222", 1)]})
+
+                result = handle_excel(upload, workers=workers)
+
+                self.assertEqual(
+                    result,
+                    [
+                        f"Sheet 'Sheet1': Invalid quantity at row {row}. "
+                        "Quantity must be a number."
+                        for row in [2, 3, 4]
+                    ],
+                )
+                self.assertEqual(
+                    sorted(Storing.objects.values_list("book_id", "quantity")),
+                    [(self.book1.id, 4), (self.book2.id, 1)],
+                )
+
+    def test_workbook_is_split_by_sheet(self):
+        upload = make_xlsx(
+            [("111", i) for i in range(10)], sheets={"Sheet2": [("222", 1)]}
+        )
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as path:
+            path.write(upload.read())
+            path.flush()
+            parts = plan_parts(path.name)
+
+        self.assertEqual(
+            [(title, prefix) for title, _, _, prefix in parts],
+            [("Sheet1", "Sheet 'Sheet1': "), ("Sheet2", "Sheet 'Sheet2': ")],
+        )
+
+
+class StockBalanceTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=self.author, barcode="111"
+        )
+
+    def test_balance_follows_every_write_path(self):
+        upload = SimpleUploadedFile("stock.txt", b"BRC111\nQNT5\nBRC111\nQNT2\n")
+        self.client.post(reverse("bulk-leftover"), {"file": upload})
+
+        response = self.client.post(
+            reverse("storing-history", kwargs={"pk": self.book.pk}),
+            {"book": self.book.pk, "quantity": -3},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.client.post(
+            reverse("add-leftover"), {"barcode": "111", "quantity": 10}, format="json"
+        )
+
+        self.assertEqual(BooksLeftOver.objects.get(book=self.book).quantity, 14)
+        response = self.client.get(reverse("book-detail", kwargs={"pk": self.book.pk}))
+        self.assertEqual(response.data["quantity"], 14)
+        self.assertEqual(
+            sum(Storing.objects.values_list("quantity", flat=True)), 14
+        )
+
+    def test_book_list_query_count_does_not_grow(self):
+        for i in range(5):
+            book = Book.objects.create(
+                title=f"Book {i}", publish_year=2015, author=self.author
+            )
+            BooksLeftOver.objects.create(book=book, quantity=i)
+
+        # The "found" count and the page's stamps for the ETag, then the page.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("book-create-search"))
+
+        self.assertEqual(
+            sorted(item["quantity"] for item in response.data["items"]),
+            [0, 0, 1, 2, 3, 4],
+        )
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        for i in range(5):
+            Book.objects.create(
+                title=f"Book {i}",
+                publish_year=2015,
+                author=author,
+                barcode=f"90{4 - i}",
+            )
+
+    def collect(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.data["found"], 5)
+            pages.append([item["barcode"] for item in response.data["items"]])
+            url = response.data["next"]
+        return pages
+
+    def test_book_list_is_paged_by_id(self):
+        pages = self.collect(reverse("book-create-search") + "?page_size=2")
+
+        self.assertEqual(pages, [["904", "903"], ["902", "901"], ["900"]])
+
+    def test_barcode_search_is_paged_by_barcode(self):
+        pages = self.collect(reverse("book-create-search") + "?barcode=90&page_size=3")
+
+        self.assertEqual(pages, [["900", "901", "902"], ["903", "904"]])
+
+    def test_found_count_is_cached(self):
+        cache.clear()
+        url = reverse("book-create-search")
+        with self.settings(API_COUNT_CACHE_TIMEOUT=60):
+            self.client.get(url)
+            Book.objects.filter(barcode="900").delete()
+            response = self.client.get(url)
+
+        self.assertEqual(response.data["found"], 5)
+        self.assertEqual(len(response.data["items"]), 4)
+
+    def test_author_list_is_paged(self):
+        response = self.client.get("/api/author/")
+
+        self.assertEqual(response.data["found"], 1)
+        self.assertEqual(response.data["items"][0]["name"], "Author 1")
+
+
+class BarcodeSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        for barcode in ["ABC123", "abc124", "X123", "9780001"]:
+            Book.objects.create(
+                title=barcode, publish_year=2015, author=author, barcode=barcode
+            )
+
+    def search(self, barcode, match=None):
+        url = reverse("book-create-search") + f"?barcode={barcode}"
+        if match:
+            url += f"&match={match}"
+        response = self.client.get(url)
+        return [item["barcode"] for item in response.data["items"]]
+
+    def test_match_modes(self):
+        self.assertEqual(self.search("ABC123", "exact"), ["ABC123"])
+        self.assertEqual(self.search("ABC12", "prefix"), ["ABC123"])
+        self.assertEqual(self.search("bc12"), ["ABC123", "abc124"])
+        self.assertEqual(self.search("123"), ["ABC123", "X123"])
+        self.assertEqual(self.search("78"), ["9780001"])
+        self.assertEqual(self.search("C1234"), [])
+
+    def test_invalid_match_mode(self):
+        response = self.client.get(
+            reverse("book-create-search") + "?barcode=1&match=fuzzy"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_barcode_changes(self):
+        book = Book.objects.get(barcode="X123")
+        book.barcode = "Y555"
+        book.save()
+
+        self.assertEqual(self.search("555"), ["Y555"])
+        self.assertEqual(self.search("123"), ["ABC123"])
+        self.assertEqual(
+            set(BarcodeTrigram.objects.filter(book=book).values_list("gram", flat=True)),
+            {"y55", "555"},
+        )
+
+
+class BarcodeIndexMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        """
+        Migrate the api app to ``target`` and return its models at that state.
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate([("api", target)])
+        executor.loader.build_graph()
+        return executor.loader.project_state(("api", target)).apps
+
+    def test_existing_books_are_indexed(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes("api")[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate("0006_backfill_stock_balance")
+        author = apps.get_model("api", "Author").objects.create(
+            name="Author 1", birth_date="1990-01-01"
+        )
+        apps.get_model("api", "Book").objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="ABC12345"
+        )
+
+        self.migrate("0007_barcodetrigram")
+        self.assertEqual(BarcodeTrigram.objects.count(), 6)
+
+        self.migrate(latest)
+        response = APIClient().get(reverse("book-create-search") + "?barcode=C123")
+        self.assertEqual(response.data["found"], 1)
+
+
+class LeftOverAdjustmentTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+
+    def post(self, name, quantity, barcode="111"):
+        return self.client.post(
+            reverse(name), {"barcode": barcode, "quantity": quantity}, format="json"
+        )
+
+    def test_add_and_remove_record_history(self):
+        response = self.post("add-leftover", 7)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["quantity"], 7)
+
+        response = self.post("remove-leftover", 3)
+        self.assertEqual(response.data["quantity"], 4)
+        self.assertEqual(response.data["book"], self.book.id)
+
+        self.assertEqual(
+            list(Storing.objects.order_by("id").values_list("quantity", flat=True)),
+            [7, -3],
+        )
+
+    def test_adjustment_of_existing_leftover_is_one_update(self):
+        self.post("add-leftover", 1)
+
+        # Savepoint, UPDATE, SELECT of the new balance, UPDATE of the shop
+        # balance, Storing INSERT, release.
+        with self.assertNumQueries(6):
+            response = self.post("add-leftover", 2)
+
+        self.assertEqual(response.data["quantity"], 3)
+
+    def test_unknown_barcode(self):
+        response = self.post("add-leftover", 1, barcode="999")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Storing.objects.exists())
+
+
+class LeftOverBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book1 = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        self.book2 = Book.objects.create(
+            title="Book 2", publish_year=2016, author=author, barcode="222"
+        )
+        BooksLeftOver.objects.create(book=self.book2, quantity=10)
+
+    def test_batch_applies_entries_in_one_go(self):
+        entries = [
+            {"barcode": "111", "quantity": 5, "op": "add"},
+            {"barcode": "222", "quantity": 3, "op": "remove"},
+            {"barcode": "999", "quantity": 1, "op": "add"},
+            {"barcode": "111", "quantity": 2, "op": "remove"},
+            {"barcode": "111", "quantity": "2", "op": "add"},
+        ]
+
+        # One barcode lookup, the Storing insert, the book and shop balance
+        # upserts and updates, one read of the balances and four savepoint
+        # statements.
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                reverse("batch-leftover"), entries, format="json"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                (result["status"], result.get("quantity"), result.get("error"))
+                for result in response.data["results"]
+            ],
+            [
+                ("ok", 5, None),
+                ("ok", 7, None),
+                ("error", None, "No Book matches the given query."),
+                ("ok", 3, None),
+                ("error", None, "Invalid input data."),
+            ],
+        )
+        self.assertEqual(BooksLeftOver.objects.get(book=self.book1).quantity, 3)
+        self.assertEqual(
+            list(Storing.objects.order_by("id").values_list("quantity", flat=True)),
+            [5, -3, -2],
+        )
+
+    def test_malformed_entries_are_reported(self):
+        entries = [
+            {"barcode": "111", "quantity": 1, "op": ["add"]},
+            {"barcode": ["111"], "quantity": 1, "op": "add"},
+            {"barcode": "111", "quantity": 1, "op": "add", "shop": [1]},
+            {"barcode": "111", "quantity": True, "op": "add"},
+            {"barcode": "111", "quantity": 1, "op": "add", "shop": True},
+            {"barcode": "111", "quantity": 1, "op": "add"},
+        ]
+
+        response = self.client.post(reverse("batch-leftover"), entries, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result.get("error") for result in response.data["results"]],
+            ["Invalid input data."] * 5 + [None],
+        )
+        self.assertEqual(BooksLeftOver.objects.get(book=self.book1).quantity, 1)
+
+    def test_batch_must_be_a_list(self):
+        response = self.client.post(
+            reverse("batch-leftover"), {"barcode": "111"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StoringHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        for day, quantity in [(1, 10), (2, -3), (3, 5), (4, -1)]:
+            add_history(self.book, quantity, datetime(2024, 1, day, 12))
+
+    def get(self, query=""):
+        return self.client.get(
+            reverse("storing-history", kwargs={"pk": self.book.pk}) + query
+        )
+
+    def test_full_history(self):
+        # The version for the ETag, the book with its balance, the balance
+        # aggregate and the page.
+        with self.assertNumQueries(4):
+            response = self.get()
+
+        self.assertEqual(response.data["book"], {"key": self.book.id, "title": "Book 1"})
+        self.assertEqual(response.data["start_balance"], 0)
+        self.assertEqual(response.data["end_balance"], 11)
+        self.assertEqual(
+            [entry["quantity"] for entry in response.data["history"]], [-1, 5, -3, 10]
+        )
+
+    def test_date_range(self):
+        # One more than without dates, for the compaction horizon.
+        with self.assertNumQueries(5):
+            response = self.get("?date_from=2024-01-02&date_to=2024-01-04")
+
+        self.assertEqual(response.data["start_balance"], 10)
+        self.assertEqual(response.data["end_balance"], 12)
+        self.assertEqual(
+            [entry["quantity"] for entry in response.data["history"]], [5, -3]
+        )
+
+    def test_history_is_paginated(self):
+        response = self.get("?page_size=3")
+        self.assertEqual(len(response.data["history"]), 3)
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [entry["quantity"] for entry in response.data["history"]], [10]
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_range_and_unknown_book(self):
+        response = self.get("?date_from=2024-01-04&date_to=2024-01-02")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse("storing-history", kwargs={"pk": 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class PointInTimeStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book1 = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        self.book2 = Book.objects.create(
+            title="Book 2", publish_year=2016, author=author, barcode="222"
+        )
+        for day, quantity in [(1, 10), (10, -3), (31, 5)]:
+            add_history(self.book1, quantity, datetime(2024, 1, day, 12))
+        add_history(self.book2, 4, datetime(2024, 1, 20, 12))
+
+    def stock(self, query):
+        return self.client.get(reverse("stock-at") + query).data
+
+    def test_balance_of_one_book(self):
+        data = self.stock("?barcode=111&at=2024-01-15")
+
+        self.assertEqual(data["quantity"], 7)
+        self.assertEqual(data["book"], self.book1.id)
+
+    def test_balance_of_every_book(self):
+        data = self.stock("?at=2024-02-01")
+
+        self.assertEqual(
+            [(item["barcode"], item["quantity"]) for item in data["items"]],
+            [("111", 12), ("222", 4)],
+        )
+
+    def test_snapshots_bound_the_history_that_is_summed(self):
+        self.assertEqual(create_snapshots(utc(2024, 1, 15)), 2)
+        self.assertEqual(
+            StockSnapshot.objects.get(book=self.book1).quantity, 7
+        )
+        # Rows before the snapshot no longer count, only the snapshot does.
+        Storing.objects.filter(date__lt=utc(2024, 1, 15)).delete()
+
+        self.assertEqual(self.stock("?barcode=111&at=2024-02-01")["quantity"], 12)
+        self.assertEqual(self.stock("?barcode=111&at=2024-01-20")["quantity"], 7)
+        self.assertEqual(self.stock("?barcode=222&at=2024-01-10")["quantity"], 0)
+
+    @override_settings(STOCK_SNAPSHOT_MARGIN_SECONDS=600)
+    def test_snapshot_command_stays_clear_of_recent_history(self):
+        call_command("create_stock_snapshots", stdout=StringIO())
+
+        moment = StockSnapshot.objects.get(book=self.book1).date
+        self.assertAlmostEqual(
+            (timezone.now() - moment).total_seconds(), 600, delta=60
+        )
+        recent = (timezone.now() - timedelta(seconds=60)).isoformat()
+        with self.assertRaises(CommandError):
+            call_command("create_stock_snapshots", at=recent, stdout=StringIO())
+
+    def test_ledger_running_balance(self):
+        url = reverse("stock-ledger", kwargs={"pk": self.book1.pk})
+
+        data = self.client.get(url + "?date_from=2024-01-05").data
+
+        self.assertEqual(data["found"], 2)
+        self.assertEqual(
+            [(row["quantity"], row["balance"]) for row in data["ledger"]],
+            [(-3, 7), (5, 12)],
+        )
+        data = self.client.get(url + "?limit=1&offset=1").data
+        self.assertEqual(
+            [(row["quantity"], row["balance"]) for row in data["ledger"]], [(-3, 7)]
+        )
+
+
+class HistoryCompactionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        for day, quantity in [(1, 10), (2, -3), (20, 5), (21, -1)]:
+            add_history(self.book, quantity, datetime(2024, 1, day, 12))
+
+    def test_compaction_keeps_balances_exact(self):
+        main_shop = Storing.objects.get(quantity=10).shop_id
+        shop = Shop.objects.create(name="Branch")
+        Storing.objects.filter(quantity=-3).update(shop=shop)
+        with tempfile.TemporaryDirectory() as archive_dir:
+            result = compact_history(utc(2024, 1, 10), archive_dir)
+            with gzip.open(result["archive"], "rt") as archive:
+                archived = list(csv.DictReader(archive))
+
+        self.assertEqual(result["deleted"], 2)
+        self.assertEqual(
+            [(row["shop_id"], row["quantity"]) for row in archived],
+            [(str(main_shop), "10"), (str(shop.id), "-3")],
+        )
+        self.assertEqual(Storing.objects.count(), 2)
+
+        history = self.client.get(
+            reverse("storing-history", kwargs={"pk": self.book.pk})
+        ).data
+        self.assertEqual(history["start_balance"], 7)
+        self.assertEqual(history["end_balance"], 11)
+        self.assertEqual(
+            [entry["quantity"] for entry in history["history"]], [-1, 5]
+        )
+
+        stock = self.client.get(reverse("stock-at") + "?barcode=111&at=2024-01-21")
+        self.assertEqual(stock.data["quantity"], 12)
+
+        ledger = self.client.get(
+            reverse("stock-ledger", kwargs={"pk": self.book.pk})
+        ).data
+        self.assertEqual(
+            [(row["quantity"], row["balance"]) for row in ledger["ledger"]],
+            [(5, 12), (-1, 11)],
+        )
+
+    def test_moments_before_the_horizon_are_rejected(self):
+        stock_url = reverse("stock-at") + "?barcode=111&at="
+        self.assertEqual(self.client.get(stock_url + "2024-01-05").data["quantity"], 7)
+
+        compact_history(utc(2024, 1, 10))
+
+        for url in [
+            stock_url + "2024-01-05",
+            reverse("stock-ledger", kwargs={"pk": self.book.pk})
+            + "?date_from=2024-01-05",
+            reverse("storing-history", kwargs={"pk": self.book.pk})
+            + "?date_to=2024-01-05",
+        ]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(stock_url + "2024-01-10").data["quantity"], 7)
+
+    def test_compaction_without_archive_can_be_repeated(self):
+        compact_history(utc(2024, 1, 10))
+        result = compact_history(utc(2024, 1, 10))
+
+        self.assertEqual(result["deleted"], 0)
+        self.assertIsNone(result["archive"])
+        self.assertEqual(StockSnapshot.objects.get().quantity, 7)
+
+
+@override_settings(API_CACHE_TIMEOUT=60)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caches["api"].clear()
+        self.client = APIClient()
+        self.author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=self.author, barcode="111"
+        )
+        self.url = reverse("book-detail", kwargs={"pk": self.book.pk})
+
+    def test_repeated_get_is_served_from_cache(self):
+        self.client.get(self.url)
+        # Changed behind the ORM signals, so the cached response is kept.
+        Book.objects.filter(pk=self.book.pk).update(title="Renamed")
+
+        # The version is cached with the data.
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.data["title"], "Book 1")
+        self.assertIn("ETag", response.headers)
+
+    def test_cached_lists_answer_conditional_requests_without_queries(self):
+        list_url = reverse("book-create-search")
+        etag = self.client.get(list_url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            response = self.client.get(list_url)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.data["found"], 1)
+
+    def test_saving_a_book_invalidates_it(self):
+        self.client.get(self.url)
+        self.book.title = "Renamed"
+        self.book.save()
+
+        self.assertEqual(self.client.get(self.url).data["title"], "Renamed")
+
+    def test_leftover_adjustments_invalidate_book_and_history(self):
+        history_url = reverse("storing-history", kwargs={"pk": self.book.pk})
+        self.client.get(self.url)
+        self.client.get(history_url)
+
+        self.client.post(
+            reverse("add-leftover"), {"barcode": "111", "quantity": 4}, format="json"
+        )
+
+        self.assertEqual(self.client.get(self.url).data["quantity"], 4)
+        self.assertEqual(self.client.get(history_url).data["end_balance"], 4)
+
+    def test_bulk_writes_invalidate_lists(self):
+        list_url = reverse("book-create-search")
+        self.client.get(list_url)
+
+        record_storing([Storing(book=self.book, quantity=9)])
+
+        self.assertEqual(self.client.get(list_url).data["items"][0]["quantity"], 9)
+
+    def test_history_rows_that_cancel_out_invalidate(self):
+        history_url = reverse("storing-history", kwargs={"pk": self.book.pk})
+        self.client.get(history_url)
+
+        upload = SimpleUploadedFile("stock.txt", b"BRC111\nQNT5\nBRC111\nQNT-5\n")
+        self.client.post(reverse("bulk-leftover"), {"file": upload})
+
+        history = self.client.get(history_url).data["history"]
+        self.assertEqual([entry["quantity"] for entry in history], [-5, 5])
+
+    def test_saving_an_author_invalidates_their_books(self):
+        self.client.get(self.url)
+        self.author.name = "Author 2"
+        self.author.save()
+
+        self.assertEqual(self.client.get(self.url).data["author"]["name"], "Author 2")
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=self.author, barcode="111"
+        )
+
+    def assertNotModified(self, url, queries=1):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Lists have no Last-Modified, which deletions would not change.
+        if queries == 1:
+            self.assertIn("Last-Modified", response.headers)
+        else:
+            self.assertNotIn("Last-Modified", response.headers)
+
+        with self.assertNumQueries(queries):
+            repeated = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(repeated.status_code, status.HTTP_304_NOT_MODIFIED)
+        return response["ETag"]
+
+    def test_unchanged_resources_are_not_modified(self):
+        # Lists count their rows and read the stamps of the page.
+        for url, queries in [
+            (reverse("book-detail", kwargs={"pk": self.book.pk}), 1),
+            (reverse("book-create-search") + "?barcode=11", 2),
+            (reverse("storing-history", kwargs={"pk": self.book.pk}), 1),
+            (reverse("author-detail", kwargs={"pk": self.author.pk}), 1),
+            ("/api/author/", 2),
+        ]:
+            with self.subTest(url=url):
+                self.assertNotModified(url, queries)
+
+    def test_writes_change_the_etag(self):
+        urls = [
+            reverse("book-detail", kwargs={"pk": self.book.pk}),
+            reverse("book-create-search"),
+            reverse("storing-history", kwargs={"pk": self.book.pk}),
+        ]
+        etags = [
+            self.assertNotModified(url, 2 if url == urls[1] else 1) for url in urls
+        ]
+
+        self.client.post(
+            reverse("add-leftover"), {"barcode": "111", "quantity": 2}, format="json"
+        )
+
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_deleting_a_book_changes_the_list_etag(self):
+        url = reverse("book-create-search")
+        Book.objects.create(title="Book 2", publish_year=2015, author=self.author)
+        etag = self.assertNotModified(url, 2)
+        Book.objects.filter(barcode="111").delete()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_zero_quantity_history_changes_the_etag(self):
+        url = reverse("storing-history", kwargs={"pk": self.book.pk})
+        etag = self.assertNotModified(url)
+
+        created = self.client.post(
+            url, {"book": self.book.pk, "quantity": 0}, format="json"
+        )
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_etag_only_covers_the_requested_page(self):
+        Book.objects.create(title="Book 2", publish_year=2015, author=self.author)
+        first_page = reverse("book-create-search") + "?page_size=1"
+        etag = self.assertNotModified(first_page, 2)
+        # A change on the second page leaves the first one as it was...
+        Book.objects.filter(title="Book 2").update(updated_at=timezone.now())
+        response = self.client.get(first_page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # ...but not a change on the first page itself.
+        Book.objects.filter(pk=self.book.pk).update(updated_at=timezone.now())
+        response = self.client.get(first_page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        for i in range(3):
+            Book.objects.create(
+                title=f"Book {i}", publish_year=2015, author=author, barcode=f"10{i}"
+            )
+
+    def test_stats_are_recorded_per_url_name(self):
+        self.client.get(reverse("book-create-search"))
+        self.client.get(reverse("book-create-search") + "?barcode=10")
+
+        response = self.client.get(reverse("internal-stats")).json()
+        stats = response["endpoints"]
+
+        # The in-memory test database is not pooled.
+        self.assertEqual(response["pool"], {})
+        book_list = stats["book-create-search"]
+        self.assertEqual(book_list["requests"], 2)
+        self.assertEqual(sum(book_list["latency_ms"]["histogram"].values()), 2)
+        self.assertEqual(book_list["queries"]["max"], 3)
+        self.assertGreater(book_list["serialize_ms"]["mean"], 0)
+        self.assertGreater(book_list["render_ms"]["mean"], 0)
+
+    def test_serializer_time_is_recorded_without_the_fast_path(self):
+        with self.settings(API_FAST_SERIALIZERS=False):
+            self.client.get(reverse("book-create-search"))
+
+        stats = registry.snapshot()["book-create-search"]
+        self.assertGreater(stats["serialize_ms"]["mean"], 0)
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_disabled_instrumentation_records_nothing(self):
+        book = Book.objects.first()
+
+        response = self.client.get(reverse("book-detail", kwargs={"pk": book.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(registry.snapshot(), {})
+
+    def test_requests_are_logged_as_json(self):
+        with self.settings(INSTRUMENTATION_LOG_REQUESTS=True):
+            with self.assertLogs("api.instrumentation", "INFO") as logs:
+                self.client.get(reverse("book-detail", kwargs={"pk": 999}))
+
+        sample = json.loads(logs.records[0].getMessage())
+        self.assertEqual(sample["endpoint"], "book-detail")
+        self.assertEqual(sample["status"], 404)
+        self.assertGreaterEqual(sample["queries"], 1)
+
+    def test_stats_are_internal(self):
+        response = self.client.get(reverse("internal-stats"), REMOTE_ADDR="10.0.0.1")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BenchmarkTests(TestCase):
+    def test_scenarios_report_their_measurements(self):
+        seed_catalog(books=30, history=3, batch_size=10)
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(Storing.objects.count(), 90)
+
+        options = {"books": 30, "requests": 3, "import_rows": 20, "imports": 1}
+        options.update(memory=True, concurrency=1)
+        with ExitStack() as cleanup:
+            options["cleanup"] = cleanup
+            for name in ["book-list", "history", "mixed-read-write", "text-import"]:
+                report = run_scenario(SCENARIOS[name], options)
+                with self.subTest(name=name):
+                    self.assertEqual(report["errors"], 0)
+                    self.assertGreater(report["queries_per_operation"], 0)
+                    self.assertIn("p99", report["latency_ms"])
+                    self.assertIn("peak_memory_kb", report)
+
+
+class AsyncReadPathTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=self.author, barcode="111"
+        )
+        Book.objects.create(
+            title="Book 2", publish_year=2016, author=self.author, barcode="112"
+        )
+        add_history(self.book, 10, datetime(2024, 1, 1))
+        add_history(self.book, -3, datetime(2024, 1, 2))
+
+    async def assertSameAsSync(self, sync_url, async_url):
+        expected = await sync_to_async(self.client.get)(
+            sync_url, HTTP_ACCEPT="application/json"
+        )
+        response = await self.async_client.get(async_url)
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response["Content-Type"], "application/json")
+        # Same bytes, except that page links stay on the async path.
+        self.assertEqual(
+            response.content.replace(b"/api/async/", b"/api/"), expected.content
+        )
+
+    async def test_responses_match_the_sync_views(self):
+        pk = self.book.pk
+        for sync_url, async_url in [
+            (f"/api/book/{pk}/", f"/api/async/book/{pk}/"),
+            ("/api/book/999/", "/api/async/book/999/"),
+            ("/api/book/?page_size=1", "/api/async/book/?page_size=1"),
+            ("/api/book/?barcode=11&match=x", "/api/async/book/?barcode=11&match=x"),
+            (f"/api/author/{self.author.pk}/", f"/api/async/author/{self.author.pk}/"),
+            (f"/api/history/{pk}/", f"/api/async/history/{pk}/"),
+            (
+                f"/api/history/{pk}/?date_from=2024-01-02",
+                f"/api/async/history/{pk}/?date_from=2024-01-02",
+            ),
+        ]:
+            with self.subTest(url=async_url):
+                await self.assertSameAsSync(sync_url, async_url)
+
+    async def test_queries_of_async_views_are_measured(self):
+        registry.reset()
+        await self.async_client.get("/api/async/book/")
+        await self.async_client.get(f"/api/async/history/{self.book.pk}/")
+
+        stats = registry.snapshot()
+        for name in ["async-book-list", "async-storing-history"]:
+            with self.subTest(name=name):
+                self.assertGreater(stats[name]["queries"]["max"], 0)
+                self.assertGreater(stats[name]["db_ms"]["mean"], 0)
+
+    async def test_ping(self):
+        response = await self.async_client.get("/api/async/ping/")
+
+        self.assertEqual(response.json(), {"message": "success"})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}", publish_year=2015, author=author, barcode=f"10{i}"
+            )
+            for i in range(3)
+        ]
+        add_history(self.books[0], 10, datetime(2024, 1, 1))
+        add_history(self.books[1], 4, datetime(2024, 1, 2))
+        add_history(self.books[0], -3, datetime(2024, 1, 3))
+
+    def content(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_books_csv_joins_authors_and_balances(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(reverse("export-books"))
+        # Rows are only read while streaming, with one query for all of them.
+        with self.assertNumQueries(1):
+            rows = list(csv.DictReader(self.content(response).splitlines()))
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="books.csv"', response["Content-Disposition"])
+        self.assertEqual([row["barcode"] for row in rows], ["100", "101", "102"])
+        self.assertEqual([row["quantity"] for row in rows], ["7", "4", "0"])
+        self.assertEqual(rows[0]["author_name"], "Author 1")
+        self.assertEqual(rows[0]["author_birth_date"], "1990-01-01")
+
+    def test_history_ndjson_with_filters(self):
+        response = self.client.get(
+            reverse("export-history")
+            + f"?format=ndjson&book={self.books[0].pk}&date_from=2024-01-02"
+        )
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["barcode"], "100")
+        self.assertEqual(rows[0]["quantity"], -3)
+        self.assertEqual(rows[0]["date"], "2024-01-03T00:00:00Z")
+
+    def test_history_xlsx(self):
+        response = self.client.get(reverse("export-history") + "?format=xlsx")
+        workbook = load_workbook(BytesIO(b"".join(response.streaming_content)))
+        rows = list(workbook.active.iter_rows(values_only=True))
+
+        self.assertEqual(
+            rows[0], ("id", "book_id", "barcode", "shop_id", "date", "quantity")
+        )
+        self.assertEqual([row[5] for row in rows[1:]], [10, 4, -3])
+        self.assertEqual(rows[1][4], datetime(2024, 1, 1))
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("export-books") + "?format=pdf")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("format", response.json())
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author \u00e9", birth_date="1990-01-01")
+        other = Author.objects.create(name="Author 2", birth_date="1985-05-05")
+        self.book = Book.objects.create(
+            title="Book \u2028 1", publish_year=2015, author=author, barcode="111"
+        )
+        Book.objects.create(title="No barcode", publish_year=2016, author=other)
+        Book.objects.create(
+            title="Book 3", publish_year=2017, author=other, barcode="112"
+        )
+        add_history(self.book, 10, datetime(2024, 1, 1, 8, 30, 15, 123456))
+        add_history(self.book, -3, datetime(2024, 1, 2))
+
+    def test_output_is_byte_for_byte_identical(self):
+        for url in [
+            "/api/book/",
+            "/api/book/?page_size=2",
+            "/api/book/?barcode=11&match=prefix",
+            "/api/author/",
+            f"/api/history/{self.book.pk}/",
+            f"/api/history/{self.book.pk}/?page_size=1",
+        ]:
+            with self.subTest(url=url):
+                fast = self.client.get(url, HTTP_ACCEPT="application/json")
+                with self.settings(API_FAST_SERIALIZERS=False):
+                    drf = self.client.get(url, HTTP_ACCEPT="application/json")
+                self.assertEqual(fast.status_code, status.HTTP_200_OK)
+                self.assertEqual(fast.content, drf.content)
+
+    def test_next_pages_match(self):
+        url = "/api/book/?page_size=1"
+        with self.settings(API_FAST_SERIALIZERS=False):
+            expected = self.client.get(url).data["next"]
+
+        self.assertEqual(self.client.get(url).data["next"], expected)
+
+
+class ShopStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        self.book = Book.objects.create(
+            title="Book 1", publish_year=2015, author=author, barcode="111"
+        )
+        self.main = Shop.objects.get(name="Main")
+        self.branch = Shop.objects.create(name="Branch")
+
+    def post(self, name, quantity, shop=None):
+        data = {"barcode": "111", "quantity": quantity}
+        if shop is not None:
+            data["shop"] = shop
+        return self.client.post(reverse(name), data, format="json")
+
+    def shop_quantities(self):
+        return dict(
+            ShopStock.objects.filter(book=self.book).values_list("shop_id", "quantity")
+        )
+
+    def test_shop_balances_add_up_to_the_total(self):
+        self.post("add-leftover", 5)
+        self.post("add-leftover", 8, shop=self.branch.id)
+        response = self.post("remove-leftover", 3, shop=self.branch.id)
+
+        self.assertEqual(response.data["quantity"], 10)
+        self.assertEqual(
+            self.shop_quantities(), {self.main.id: 5, self.branch.id: 5}
+        )
+        self.assertEqual(
+            list(Storing.objects.order_by("id").values_list("shop_id", flat=True)),
+            [self.main.id, self.branch.id, self.branch.id],
+        )
+
+        response = self.client.get(reverse("book-stock", kwargs={"pk": self.book.pk}))
+        self.assertEqual(response.data["quantity"], 10)
+        self.assertEqual(
+            [(shop["name"], shop["quantity"]) for shop in response.data["shops"]],
+            [("Main", 5), ("Branch", 5)],
+        )
+
+    def test_unknown_shop(self):
+        for shop in [999, True, [1]]:
+            response = self.post("add-leftover", 5, shop=shop)
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Storing.objects.exists())
+
+    def test_batch_with_shops(self):
+        entries = [
+            {"barcode": "111", "quantity": 4, "op": "add", "shop": self.branch.id},
+            {"barcode": "111", "quantity": 2, "op": "add"},
+            {"barcode": "111", "quantity": 1, "op": "add", "shop": 999},
+        ]
+        response = self.client.post(reverse("batch-leftover"), entries, format="json")
+
+        self.assertEqual(
+            [result.get("error") for result in response.data["results"]],
+            [None, None, "Unknown shop."],
+        )
+        self.assertEqual(
+            self.shop_quantities(), {self.main.id: 2, self.branch.id: 4}
+        )
+        self.assertEqual(BooksLeftOver.objects.get(book=self.book).quantity, 6)
+
+    def test_history_of_one_shop(self):
+        self.post("add-leftover", 5)
+        self.post("add-leftover", 8, shop=self.branch.id)
+        url = reverse("storing-history", kwargs={"pk": self.book.pk})
+
+        response = self.client.get(url + f"?shop={self.branch.id}")
+
+        self.assertEqual(response.data["end_balance"], 8)
+        self.assertEqual(
+            [entry["quantity"] for entry in response.data["history"]], [8]
+        )
+        self.assertEqual(self.client.get(url).data["end_balance"], 13)
+
+    def test_bulk_import_into_a_shop(self):
+        response = self.client.post(
+            reverse("bulk-leftover") + f"?shop={self.branch.id}",
+            {"file": SimpleUploadedFile("stock.txt", b"BRC111\nQNT7\n")},
+            format="multipart",
+        )
+
+        self.assertEqual(response.data, {"success": "Data uploaded successfully"})
+        self.assertEqual(self.shop_quantities(), {self.branch.id: 7})
+
+        response = self.client.post(
+            reverse("bulk-leftover") + "?shop=999",
+            {"file": SimpleUploadedFile("stock.txt", b"BRC111\nQNT7\n")},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    # Not a TestCase: reads inside its transaction would stay on the primary.
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_alias(self, request):
+        """
+        Run ``request`` through the middleware, returning the alias a read
+        in its view was routed to and the response.
+        """
+        aliases = []
+
+        def view(request):
+            aliases.append(self.router.db_for_read(Book))
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return aliases[0], response
+
+    def test_reads_go_to_replicas_and_writes_to_the_primary(self):
+        self.assertIn(self.router.db_for_read(Book), {"replica1", "replica2"})
+        self.assertEqual(self.router.db_for_write(Book), "default")
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Book), "default")
+        self.assertFalse(self.router.allow_migrate("replica1", "api"))
+        self.assertTrue(self.router.allow_migrate("default", "api"))
+
+    def test_client_reads_its_writes(self):
+        alias, response = self.read_alias(self.factory.get("/api/book/"))
+        self.assertNotEqual(alias, "default")
+
+        alias, response = self.read_alias(self.factory.post("/api/book/"))
+        self.assertEqual(alias, "default")
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+
+        request = self.factory.get("/api/book/")
+        request.COOKIES[PRIMARY_COOKIE] = response.cookies[PRIMARY_COOKIE].value
+        alias, response = self.read_alias(request)
+        self.assertEqual(alias, "default")
+
+        request.COOKIES[PRIMARY_COOKIE] = "0"
+        alias, response = self.read_alias(request)
+        self.assertNotEqual(alias, "default")
+
+    def test_reads_of_a_request_stay_on_one_replica(self):
+        for _ in range(10):
+            aliases = set()
+
+            def view(request):
+                aliases.update(self.router.db_for_read(Book) for _ in range(20))
+                return HttpResponse()
+
+            ReplicaRoutingMiddleware(view)(self.factory.get("/api/book/"))
+            self.assertEqual(len(aliases), 1)
+            self.assertIn(aliases.pop(), {"replica1", "replica2"})
+
+        with use_replica(), use_primary():
+            self.assertEqual(self.router.db_for_read(Book), "default")
+
+    @override_settings(API_CACHE_TIMEOUT=60)
+    def test_only_primary_reads_are_cached(self):
+        caches["api"].clear()
+
+        class View:
+            calls = 0
+
+            @cached_response("book-list")
+            def get(self, request):
+                self.calls += 1
+                return Response({"calls": self.calls})
+
+        view = View()
+        request = self.factory.get("/api/book/")
+        with use_replica():
+            view.get(request)
+            self.assertEqual(view.get(request).data, {"calls": 2})
+        with use_primary():
+            self.assertEqual(view.get(request).data, {"calls": 3})
+        # Cached responses from the primary are served to every client.
+        with use_replica():
+            self.assertEqual(view.get(request).data, {"calls": 3})
+
+    def test_without_replicas_everything_uses_the_primary(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            alias, response = self.read_alias(self.factory.post("/api/book/"))
+
+        self.assertEqual(alias, "default")
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class MaintenanceReadsTests(TransactionTestCase):
+    # Outside a transaction, where reads would go to the replica, which is
+    # not configured here: any read routed to it fails.
+
+    def test_maintenance_reads_use_the_primary(self):
+        with use_primary():
+            author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+            book = Book.objects.create(
+                title="Book 1", publish_year=2015, author=author, barcode="111"
+            )
+            storing = Storing.objects.create(
+                book=book, shop=Shop.objects.create(name="Main"), quantity=3
+            )
+            Storing.objects.filter(pk=storing.pk).update(
+                date=timezone.now() - timedelta(days=2)
+            )
+
+        self.assertEqual(create_snapshots(timezone.now()), 1)
+        rebuild_index()
+        with tempfile.TemporaryDirectory() as archive_dir:
+            result = compact_history(timezone.now() - timedelta(days=1), archive_dir)
+
+        self.assertEqual(result["deleted"], 1)
+        with use_primary():
+            self.assertTrue(BarcodeTrigram.objects.filter(book=book).exists())
+
+
+class ReplicaSyncTests(TransactionTestCase):
+    # Outside a transaction: the backup waits for open write transactions.
+
+    def test_copy_sqlite_database(self):
+        author = Author.objects.create(name="Author 1", birth_date="1990-01-01")
+        Book.objects.create(title="Book 1", publish_year=2015, author=author)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/replica.sqlite3"
+            copy_sqlite_database(connection, path)
+            replica = sqlite3.connect(path)
+            try:
+                (count,) = replica.execute("SELECT COUNT(*) FROM api_book").fetchone()
+            finally:
+                replica.close()
+
+        self.assertEqual(count, 1)
+
+
+class TunedSQLiteBackendTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.handler = ConnectionHandler(
+            {
+                alias: {
+                    "ENGINE": "book_storage.db_backends.sqlite3",
+                    "NAME": f"{directory.name}/tuned.sqlite3",
+                    "OPTIONS": {"pragmas": {"busy_timeout": 100}},
+                }
+                for alias in ["default", "second"]
+            }
+        )
+        self.addCleanup(self.handler.close_all)
+
+    def pragma(self, alias, name):
+        with self.handler[alias].cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(self.pragma("default", "journal_mode"), "wal")
+        self.assertEqual(self.pragma("default", "synchronous"), 1)
+        self.assertEqual(self.pragma("default", "busy_timeout"), 100)
+
+    def test_write_transactions_queue_in_the_process(self):
+        first, second = self.handler["default"], self.handler["second"]
+        first.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertTrue(first.holds_write_lock)
+
+        with self.assertRaises(OperationalError):
+            second.set_autocommit(
+                False, force_begin_transaction_with_broken_autocommit=True
+            )
+        self.assertFalse(second.holds_write_lock)
+
+        first.rollback()
+        first.set_autocommit(True)
+        second.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertTrue(second.holds_write_lock)
+        second.commit()
+        self.assertFalse(second.holds_write_lock)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(max_size=2, idle_timeout=60, timeout=1)
+        first = pool.checkout(FakeConnection)
+        pool.checkin(first)
+
+        self.assertIs(pool.checkout(FakeConnection), first)
+        stats = pool.stats()
+        self.assertEqual((stats["checkouts"], stats["created"]), (2, 1))
+        self.assertEqual((stats["reused"], stats["in_use"]), (1, 1))
+
+    def test_full_pool_waits_and_times_out(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60, timeout=0.05)
+        pool.checkout(FakeConnection)
+
+        with self.assertRaises(OperationalError):
+            pool.checkout(FakeConnection)
+        self.assertEqual((pool.stats()["waits"], pool.stats()["timeouts"]), (1, 1))
+
+    def test_idle_and_broken_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=0, timeout=1)
+        idle = pool.checkout(FakeConnection)
+        pool.checkin(idle)
+        time.sleep(0.01)
+        fresh = pool.checkout(FakeConnection)
+        self.assertTrue(idle.closed)
+
+        pool.checkin(fresh)
+        pool.idle_timeout = 60
+        replaced = pool.checkout(FakeConnection, check=lambda conn: False)
+        self.assertIsNot(replaced, fresh)
+        self.assertTrue(fresh.closed)
+        stats = pool.stats()
+        self.assertEqual((stats["closed_idle"], stats["discarded"]), (1, 1))
+        self.assertEqual(stats["size"], 1)
+
+
+class LazyImportTests(SimpleTestCase):
+    def test_web_workers_do_not_load_pandas(self):
+        # A fresh interpreter: this one has imported pandas for other tests.
+        code = (
+            "import sys, django; django.setup(); import book_storage.urls; "
+            "print(sorted({'pandas', 'numpy', 'openpyxl'} & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={"DJANGO_SETTINGS_MODULE": "book_storage.settings", **os.environ},
+        )
+
+        self.assertEqual(result.stdout.strip(), "[]")
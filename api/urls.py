@@ -1,23 +1,66 @@
 from django.urls import path
+from . import async_views
+from .instrumentation import stats_view
 from .views import (
     AuthorDetailView,
     BookDetailView,
     BookRetrieveAPIView,
     BulkCreateStorageView,
+    BulkImportJobView,
     StoringHistoryView,
     GetAuthorDetailView,
     BooksLeftOverView,
+    StockAtView,
+    StockLedgerView,
+    BooksLeftOverBatchView,
+    BookStockView,
+    ShopListView,
+    ShopStockView,
+    export_books_view,
+    export_history_view,
     ping_view,
 )
 
 urlpatterns = [
     path("ping/", ping_view, name="ping"),
+    path("internal/stats/", stats_view, name="internal-stats"),
     path("author/<int:pk>/", GetAuthorDetailView.as_view(), name="author-detail"),
     path("author/", AuthorDetailView.as_view()),
     path("book/<int:pk>/", BookRetrieveAPIView.as_view(), name="book-detail"),
     path("book/", BookDetailView.as_view(), name="book-create-search"),
+    path("book/<int:pk>/stock/", BookStockView.as_view(), name="book-stock"),
+    path("shop/", ShopListView.as_view(), name="shop-list"),
+    path("shop/<int:pk>/stock/", ShopStockView.as_view(), name="shop-stock"),
     path("history/<int:pk>/", StoringHistoryView.as_view(), name="storing-history"),
+    path("stock/", StockAtView.as_view(), name="stock-at"),
+    path("stock/<int:pk>/ledger/", StockLedgerView.as_view(), name="stock-ledger"),
     path("leftover/add/", BooksLeftOverView.as_view(), name="add-leftover"),
     path("leftover/remove/", BooksLeftOverView.as_view(), name="remove-leftover"),
+    path(
+        "leftover/batch/", BooksLeftOverBatchView.as_view(), name="batch-leftover"
+    ),
     path("leftover/bulk/", BulkCreateStorageView.as_view(), name="bulk-leftover"),
+    path(
+        "leftover/bulk/<int:pk>/",
+        BulkImportJobView.as_view(),
+        name="bulk-leftover-job",
+    ),
+    path("export/books/", export_books_view, name="export-books"),
+    path("export/history/", export_history_view, name="export-history"),
+    # Async read path for ASGI servers
+    path("async/ping/", async_views.ping_view, name="async-ping"),
+    path(
+        "async/author/<int:pk>/",
+        async_views.author_detail_view,
+        name="async-author-detail",
+    ),
+    path(
+        "async/book/<int:pk>/", async_views.book_detail_view, name="async-book-detail"
+    ),
+    path("async/book/", async_views.book_list_view, name="async-book-list"),
+    path(
+        "async/history/<int:pk>/",
+        async_views.storing_history_view,
+        name="async-storing-history",
+    ),
 ]
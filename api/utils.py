@@ -1,103 +1,363 @@
+import multiprocessing
+import shutil
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
 from api.models import Book, Storing
-import pandas as pd
+from api.quantities import MAX_QUANTITY, MIN_QUANTITY
+from api.stock import record_storing
+
+# pandas, NumPy and openpyxl, which api.excel uses, take a few hundred
+# milliseconds and tens of MB to import. api.excel is imported inside the
+# Excel import functions, so that processes which never import a workbook,
+# like most web workers, never load them.
+
+DEFAULT_IMPORT_CHUNK_SIZE = 5000
+
+# A parsed upload record. ``error`` is set when the record failed validation
+# while parsing; ``not_found`` is the message reported when the barcode does
+# not match any book.
+ImportRow = namedtuple("ImportRow", ["barcode", "quantity", "error", "not_found"])
+
+
+def get_import_chunk_size():
+    return getattr(settings, "BULK_IMPORT_CHUNK_SIZE", DEFAULT_IMPORT_CHUNK_SIZE)
+
+
+def get_excel_workers():
+    return getattr(settings, "BULK_IMPORT_EXCEL_WORKERS", 0)
+
 
+def iter_chunks(iterable, size):
+    """
+    Split an iterable into lists of at most ``size`` items without
+    materializing more than one list at a time.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
-def handle_excel(file):
+
+def iter_excel_frames(file, chunk_size):
+    """
+    Lazily read every sheet of a workbook that has a quantity column as raw
+    frames of at most ``chunk_size`` rows, each paired with the prefix its
+    error messages use. Rows are numbered as in the spreadsheet.
+    """
+    from openpyxl import load_workbook
+
+    from api.excel import data_sheets, frame_from_rows, sheet_prefix
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
     try:
-        df = pd.read_excel(file)
-        df["is_null"] = df["quantity"].isnull()
+        sheets = data_sheets(workbook)
+        for title, barcode_col, quantity_col, _ in sheets:
+            prefix = sheet_prefix(title, len(sheets))
+            rows = workbook[title].iter_rows(min_row=2, values_only=True)
+            row_number = 2
+            for chunk in iter_chunks(rows, chunk_size):
+                yield frame_from_rows(
+                    chunk, barcode_col, quantity_col, row_number
+                ), prefix
+                row_number += len(chunk)
+    finally:
+        workbook.close()
 
-    except Exception as e:
-        raise e
 
-    errors = []  # List to store validation errors
-    store_list = []
-    for index, row in df.iterrows():
-        barcode = row.get("barcode", "")
-        quantity = row.get("quantity", "")
-        is_null = row.get("is_null")
-        if not barcode:
-            continue
+def iter_text_rows(file):
+    """
+    Lazily read BRC/QNT record pairs from a text upload.
+
+    Every ``BRC<barcode>`` line must be directly followed by a
+    ``QNT<quantity>`` line. Only the previous line is kept in memory.
+    """
+    pending = None  # (line_number, barcode) of a BRC line awaiting its QNT
+
+    for line_number, line_bytes in enumerate(file):
+        line = line_bytes.strip()
 
-        try:
-            if is_null:
-                errors.append(f"Error at row {index + 2}. Quantity cannot be blank.")
-            else:
-                quantity = int(quantity)
-                book_obj = Book.objects.filter(barcode=barcode)
-                if not book_obj.exists():
-                    errors.append(
-                        f"Error at row {index + 2}. Book with barcode: {barcode} does not exist"
+        if pending is not None:
+            brc_line_number, barcode = pending
+            pending = None
+            if not line.startswith(b"QNT"):
+                yield ImportRow(
+                    barcode, None, f"Missing quantity at line {line_number + 1}.", None
+                )
+            elif barcode:
+                try:
+                    quantity = int(line[3:])
+                    if not MIN_QUANTITY <= quantity <= MAX_QUANTITY:
+                        raise ValueError(quantity)
+                except ValueError:
+                    yield ImportRow(
+                        barcode,
+                        None,
+                        f"Invalid quantity at line {line_number + 1}. Quantity must be a number.",
+                        None,
                     )
                 else:
-                    store_list.append(Storing(book=book_obj.first(), quantity=quantity))
+                    yield ImportRow(
+                        barcode,
+                        quantity,
+                        None,
+                        f"Book with barcode '{barcode}' not found at line {brc_line_number + 1}.",
+                    )
+
+        if line.startswith(b"BRC"):
+            pending = (line_number, line[3:].decode("utf-8"))
+
+    if pending is not None:
+        yield ImportRow(
+            pending[1],
+            None,
+            f"Missing quantity line for barcode at line {pending[0] + 1}.",
+            None,
+        )
+
+
+def resolve_barcodes(barcodes):
+    """
+    Map barcodes to book ids with one ``barcode__in`` query per batch of
+    parameters the database accepts. Unknown barcodes are left out of the
+    returned dict.
+    """
+    batch_size = connection.features.max_query_params or DEFAULT_IMPORT_CHUNK_SIZE
+    book_ids = {}
+    for batch in iter_chunks(set(barcodes), batch_size):
+        book_ids.update(
+            Book.objects.filter(barcode__in=batch).values_list("barcode", "id")
+        )
+    return book_ids
+
+
+def store_rows(rows, errors, shop_id=None):
+    """
+    Validate one chunk of parsed rows and write the valid ones with a single
+    ``bulk_create``, updating the book balances. Error messages are appended
+    to ``errors`` in row order.
+    """
+    book_ids = resolve_barcodes(row.barcode for row in rows if not row.error)
+
+    store_list = []
+    for row in rows:
+        if row.error:
+            errors.append(row.error)
+            continue
+        book_id = book_ids.get(row.barcode)
+        if book_id is None:
+            errors.append(row.not_found)
+            continue
+        store_list.append(Storing(book_id=book_id, quantity=row.quantity))
 
-        except ValueError:
-            errors.append(
-                f"Invalid quantity at row {index + 2}. Quantity must be a number."
-            )
     if store_list:
-        Storing.objects.bulk_create(store_list)
+        record_storing(store_list, shop_id=shop_id)
+
+
+def resolve_frame(clean, frame_errors, prefix, book_ids):
+    """
+    Join validated rows against a barcode -> book_id map.
+
+    Returns the error messages of the frame, including unknown barcodes, in
+    row order and the Storing objects to create for the remaining rows.
+    """
+    import pandas as pd
+
+    from api.excel import not_found_messages
+
+    book_id = clean["barcode"].map(book_ids)
+    missing = book_id.isna()
+    not_found = pd.DataFrame(
+        {
+            "row_number": clean["row_number"][missing],
+            "message": not_found_messages(
+                clean["row_number"][missing], clean["barcode"][missing], prefix
+            ),
+        }
+    )
+    messages = (
+        pd.concat([frame_errors, not_found])
+        .sort_values("row_number", kind="stable")["message"]
+        .tolist()
+    )
+    store_list = [
+        Storing(book_id=book, quantity=quantity)
+        for book, quantity in zip(
+            book_id[~missing].astype("int64").tolist(),
+            clean["quantity"][~missing].tolist(),
+        )
+    ]
+    return messages, store_list
+
+
+def import_excel(file, chunk_size=None, on_chunk=None, shop_id=None, skip_chunks=0):
+    """
+    Stream a workbook chunk by chunk, validating every chunk with column
+    operations and saving it with a single ``bulk_create``. See
+    ``import_rows`` for ``on_chunk`` and ``skip_chunks``.
+    """
+    from api.excel import validate_frame
+
+    errors = []  # List to store validation errors
+    frames = iter_excel_frames(file, chunk_size or get_import_chunk_size())
+    for index, (frame, prefix) in enumerate(frames):
+        if index < skip_chunks:
+            continue
+        clean, frame_errors = validate_frame(frame, prefix)
+        book_ids = resolve_barcodes(clean["barcode"].unique())
+        messages, store_list = resolve_frame(clean, frame_errors, prefix, book_ids)
+        with transaction.atomic():
+            if store_list:
+                record_storing(store_list, shop_id=shop_id)
+            if on_chunk is not None:
+                on_chunk(len(clean) + len(frame_errors), messages)
+        errors.extend(messages)
+
     if errors:
         return errors
     else:
         return True
 
 
-def handle_text(file):
+def import_rows(rows, chunk_size=None, on_chunk=None, shop_id=None, skip_chunks=0):
+    """
+    Import parsed rows chunk by chunk so that memory use does not depend on
+    the size of the upload.
+
+    ``on_chunk(processed, messages)`` is called after every chunk with the
+    number of rows it contained and the error messages of the rejected
+    ones, in the transaction that saves the chunk. The first
+    ``skip_chunks`` chunks are skipped, to resume an import whose earlier
+    chunks were saved.
+    """
     errors = []  # List to store validation errors
+    for index, chunk in enumerate(
+        iter_chunks(rows, chunk_size or get_import_chunk_size())
+    ):
+        if index < skip_chunks:
+            continue
+        messages = []
+        with transaction.atomic():
+            store_rows(chunk, messages, shop_id)
+            if on_chunk is not None:
+                on_chunk(len(chunk), messages)
+        errors.extend(messages)
 
-    # Read lines from the file
-    lines = file.readlines()
-    store_list = []
+    if errors:
+        return errors
+    else:
+        return True
 
-    for line_number, line_bytes in enumerate(lines):
-        line = line_bytes.strip()
 
-        if line.startswith(b"BRC"):
-            barcode = line[3:]
-            barcode = barcode.decode("utf-8")
-            # Check if there is a quantity line following the barcode
-            if line_number + 1 < len(lines):
-                quantity_line_bytes = lines[line_number + 1]
-                quantity_line = quantity_line_bytes.strip()
-            else:
-                errors.append(
-                    f"Missing quantity line for barcode at line {line_number + 1}."
-                )
-                continue
-            if not quantity_line.startswith(b"QNT"):
-                errors.append(f"Missing quantity at line {line_number + 2}.")
-                continue
-
-            quantity = quantity_line[3:]
-
-            # Validate and save the data
-            if not barcode:
-                continue
-
-            try:
-                book_obj = Book.objects.filter(barcode=barcode)
-            except Book.DoesNotExist:
-                errors.append(
-                    f"Book with barcode '{barcode}' not found at line {line_number + 1}."
-                )
-                continue
-            try:
-                quantity = int(quantity)
-            except ValueError:
-                errors.append(
-                    f"Invalid quantity at line {line_number + 2}. Quantity must be a number."
-                )
-                continue
+@contextmanager
+def local_path(file):
+    """
+    Yield a filesystem path for an uploaded or stored file, copying it to a
+    temporary file when it only lives in memory.
+    """
+    if hasattr(file, "temporary_file_path"):
+        yield file.temporary_file_path()
+        return
+    try:
+        path = file.path
+    except (AttributeError, NotImplementedError):
+        path = None
+    if path:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".xlsx") as copy:
+        file.seek(0)
+        shutil.copyfileobj(file, copy)
+        copy.flush()
+        yield copy.name
+
+
+def import_excel_parallel(
+    file, workers, chunk_size=None, on_chunk=None, shop_id=None, skip_chunks=0
+):
+    """
+    Parse a workbook with a pool of ``workers`` processes, one per sheet,
+    and save the clean rows with a single bulk insert. The whole workbook
+    is one chunk for ``on_chunk`` and ``skip_chunks``.
+
+    The pool spawns fresh interpreters rather than forking: this runs in
+    multi-threaded web and import worker processes, and a forked child can
+    inherit locks held by their other threads.
+    """
+    from api.excel import parse_part, plan_parts
+
+    if skip_chunks:
+        return True
+
+    with local_path(file) as path:
+        parts = plan_parts(path)
+        if len(parts) == 1:
+            results = [parse_part(path, parts[0])]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(parts)),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                results = list(pool.map(parse_part, [path] * len(parts), parts))
+
+    book_ids = resolve_barcodes(
+        barcode for clean, _ in results for barcode in clean["barcode"].unique()
+    )
+
+    errors = []  # List to store validation errors
+    store_list = []
+    processed = 0
+    for part, (clean, part_errors) in zip(parts, results):
+        processed += len(clean) + len(part_errors)
+        messages, part_store_list = resolve_frame(
+            clean, part_errors, part[-1], book_ids
+        )
+        errors.extend(messages)
+        store_list.extend(part_store_list)
+
+    with transaction.atomic():
+        if store_list:
+            record_storing(
+                store_list,
+                batch_size=chunk_size or get_import_chunk_size(),
+                shop_id=shop_id,
+            )
+        if on_chunk is not None:
+            on_chunk(processed, errors)
 
-            try:
-                store_list.append(Storing(book=book_obj.first(), quantity=quantity))
-            except Exception as e:
-                errors.append(f"Error saving data at line {line_number + 1}: {str(e)}")
-    if store_list:
-        Storing.objects.bulk_create(store_list)
     if errors:
         return errors
     else:
         return True
+
+
+def handle_excel(
+    file, chunk_size=None, on_chunk=None, workers=None, shop_id=None, skip_chunks=0
+):
+    """
+    Import a stock workbook into a shop (by default ``DEFAULT_SHOP_ID``), in
+    parallel worker processes when ``workers`` (default
+    ``BULK_IMPORT_EXCEL_WORKERS``) is more than one, otherwise streaming it
+    chunk by chunk.
+    """
+    workers = get_excel_workers() if workers is None else workers
+    if workers > 1:
+        return import_excel_parallel(
+            file, workers, chunk_size, on_chunk, shop_id, skip_chunks
+        )
+    return import_excel(file, chunk_size, on_chunk, shop_id, skip_chunks)
+
+
+def handle_text(file, chunk_size=None, on_chunk=None, shop_id=None, skip_chunks=0):
+    return import_rows(
+        iter_text_rows(file), chunk_size, on_chunk, shop_id, skip_chunks
+    )
@@ -1,28 +1,127 @@
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import transaction
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import JsonResponse
+from rest_framework.exceptions import ValidationError
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework.views import APIView
 
-from .models import Author, Book, BooksLeftOver
+from .models import (
+    Author,
+    Book,
+    BooksLeftOver,
+    ImportJob,
+    Shop,
+    ShopStock,
+    Storing,
+)
+from .pagination import (
+    CatalogCursorPagination,
+    HistoryCursorPagination,
+    LedgerPagination,
+)
 from .serializers import (
     CreateBooksLeftOverSerializer,
     GetAuthorDetailsSerializer,
     BookDetailsSerializer,
-    GetHistorySerializer,
+    HistoryFilterSerializer,
+    ShopHistoryFilterSerializer,
+    ShopSerializer,
+    StockAtSerializer,
     CreateBookSerializer,
     CreateStorageSerializer,
+    ExportSerializer,
+    HistoryExportSerializer,
+    ImportJobSerializer,
 )
 
-from .signals import create_storing_entry
-from api.utils import handle_excel, handle_text
+from api.cache import cached_response
+from api.exports import (
+    BOOK_COLUMNS,
+    HISTORY_COLUMNS,
+    book_rows,
+    export_response,
+    history_rows,
+)
+from api.conditional import conditional_response
+from api.fastpath import (
+    author_item,
+    author_values,
+    book_item,
+    book_values,
+    history_item,
+    use_fast_serializers,
+)
+from api.instrumentation import serializing
+from api.jobs import enqueue_import
+from api.search import MATCH_CONTAINS, MATCH_MODES, search_books
+from api.stock import (
+    adjust_leftover,
+    apply_stock_deltas,
+    balances_at,
+    history_balances,
+    record_storing,
+    running_balances,
+)
+from api.utils import handle_excel, handle_text, resolve_barcodes
 
 
 def ping_view(request):
     return JsonResponse({"message": "success"})
 
 
+def is_integer(value):
+    """
+    Whether a parsed JSON value is an integer; ``true`` and ``false`` are not.
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def existing_shops(shop_ids):
+    """
+    Return the set of the given shop ids that exist, with one query.
+    """
+    shop_ids = [shop_id for shop_id in shop_ids if is_integer(shop_id)]
+    if not shop_ids:
+        return set()
+    return set(Shop.objects.filter(id__in=shop_ids).values_list("id", flat=True))
+
+
+def export_books_view(request):
+    """
+    Stream every book with its author and balance as CSV, NDJSON or XLSX.
+    """
+    query = ExportSerializer(data=request.GET)
+    if not query.is_valid():
+        return JsonResponse(query.errors, status=status.HTTP_400_BAD_REQUEST)
+    return export_response(
+        "books", BOOK_COLUMNS, book_rows(), query.validated_data["format"]
+    )
+
+
+def export_history_view(request):
+    """
+    Stream the Storing history, optionally of one book and date range, as
+    CSV, NDJSON or XLSX.
+    """
+    query = HistoryExportSerializer(data=request.GET)
+    if not query.is_valid():
+        return JsonResponse(query.errors, status=status.HTTP_400_BAD_REQUEST)
+    rows = history_rows(
+        query.validated_data.get("date_from"),
+        query.validated_data.get("date_to"),
+        query.validated_data.get("book"),
+        query.validated_data.get("shop"),
+    )
+    return export_response(
+        "history", HISTORY_COLUMNS, rows, query.validated_data["format"]
+    )
+
+
 class AuthorDetailView(generics.ListCreateAPIView):
     """
     View to list and create Author instances.
@@ -30,6 +129,22 @@ class AuthorDetailView(generics.ListCreateAPIView):
 
     queryset = Author.objects.all()
     serializer_class = GetAuthorDetailsSerializer
+    pagination_class = CatalogCursorPagination
+
+    def get_version(self):
+        return self.paginator.get_page_version(
+            self.get_queryset(), self.request, self, ["updated_at"]
+        )
+
+    @cached_response("author-list")
+    @conditional_response
+    def list(self, request, *args, **kwargs):
+        if not use_fast_serializers():
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(author_values(self.get_queryset()))
+        with serializing():
+            items = [author_item(row) for row in page]
+        return self.get_paginated_response(items)
 
 
 class GetAuthorDetailView(generics.RetrieveAPIView):
@@ -40,6 +155,18 @@ class GetAuthorDetailView(generics.RetrieveAPIView):
     queryset = Author.objects.all()
     serializer_class = GetAuthorDetailsSerializer
 
+    def get_version(self):
+        return (
+            Author.objects.filter(pk=self.kwargs["pk"])
+            .values_list("updated_at")
+            .first()
+        )
+
+    @cached_response("author:{pk}")
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class BookDetailView(generics.ListCreateAPIView):
     """
@@ -48,17 +175,50 @@ class BookDetailView(generics.ListCreateAPIView):
 
     queryset = Book.objects.all()
     serializer_class = CreateBookSerializer
+    pagination_class = CatalogCursorPagination
 
     def get_queryset(self):
         """
-        Filter the queryset based on the barcode query parameter.
+        Filter the queryset based on the barcode query parameter, matched as
+        a substring unless ``match`` asks for an ``exact`` or ``prefix`` match.
         """
-        queryset = Book.objects.all()
+        queryset = Book.objects.select_related("author", "books")
         barcode = self.request.query_params.get("barcode")
         if barcode:
-            queryset = queryset.filter(barcode__icontains=barcode).order_by("barcode")
+            match = self.request.query_params.get("match", MATCH_CONTAINS)
+            if match not in MATCH_MODES:
+                raise ValidationError(
+                    {"match": [f"Must be one of: {', '.join(MATCH_MODES)}."]}
+                )
+            queryset = search_books(queryset, barcode, match)
         return queryset
 
+    def get_version(self):
+        return self.paginator.get_page_version(
+            self.get_queryset(),
+            self.request,
+            self,
+            ["updated_at", "author__updated_at", "books__updated_at"],
+        )
+
+    @cached_response("books-all", "book-list")
+    @conditional_response
+    def list(self, request, *args, **kwargs):
+        if not use_fast_serializers():
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(book_values(self.get_queryset()))
+        with serializing():
+            items = [book_item(row) for row in page]
+        return self.get_paginated_response(items)
+
+    def get_cursor_ordering(self):
+        """
+        Page barcode searches in barcode order, everything else by id.
+        """
+        if self.request.query_params.get("barcode"):
+            return "barcode"
+        return "id"
+
     def get_serializer_class(self):
         """
         Return different serializer class based on the request method.
@@ -67,48 +227,245 @@ class BookDetailView(generics.ListCreateAPIView):
             return CreateBookSerializer
         return BookDetailsSerializer
 
-    def list(self, request, *args, **kwargs):
-        """
-        List view with additional data about found items count.
-        """
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-
-        # Include found items count in the serialized data
-        response_data = {"found": len(serializer.data), "items": serializer.data}
-
-        return Response(response_data, status=status.HTTP_200_OK)
-
 
 class BookRetrieveAPIView(generics.RetrieveAPIView):
     """
     View to retrieve details of a specific Book instance.
     """
 
-    queryset = Book.objects.all()
+    queryset = Book.objects.select_related("author", "books")
     serializer_class = BookDetailsSerializer
 
+    def get_version(self):
+        return (
+            Book.objects.filter(pk=self.kwargs["pk"])
+            .values_list("updated_at", "author__updated_at", "books__updated_at")
+            .first()
+        )
+
+    @cached_response("books-all", "book:{pk}")
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
-class StoringHistoryView(generics.ListCreateAPIView):
+class StoringHistoryView(generics.CreateAPIView):
     """
     View to list and create Storing history for a specific Book instance.
     """
 
-    queryset = Book.objects.all()
+    serializer_class = CreateStorageSerializer
 
-    def get_serializer_class(self):
+    def get_version(self):
+        return (
+            Book.objects.filter(pk=self.kwargs["pk"])
+            .values_list("updated_at", "books__updated_at")
+            .first()
+        )
+
+    @cached_response("books-all", "book:{pk}", "history:{pk}")
+    @conditional_response
+    def get(self, request, *args, **kwargs):
+        book = get_object_or_404(self.get_book_queryset(), pk=kwargs["pk"])
+        return Response(self.get_history_data(book))
+
+    def get_book_queryset(self):
+        return Book.objects.select_related("books").only("id", "title", "books")
+
+    def get_history_data(self, book):
         """
-        Return different serializer class based on the request method.
+        Return the book, its balance at the start and end of the requested
+        date range and one page of the history rows in it, newest first.
+        With ``shop`` only the history and balance in that shop are used.
         """
-        if self.request.method == "POST":
-            return CreateStorageSerializer
-        return GetHistorySerializer
+        filters = ShopHistoryFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        date_from = filters.validated_data.get("date_from")
+        date_to = filters.validated_data.get("date_to")
+        shop = filters.validated_data.get("shop")
+
+        history = Storing.objects.filter(book_id=book.id)
+        if shop is None:
+            leftover = getattr(book, "books", None)
+            balance = leftover.quantity if leftover else 0
+        else:
+            history = history.filter(shop=shop)
+            balance = (
+                ShopStock.objects.filter(shop=shop, book=book)
+                .values_list("quantity", flat=True)
+                .first()
+                or 0
+            )
+        start_balance, end_balance = history_balances(
+            book.id, balance, date_from, date_to, shop.id if shop else None
+        )
 
-    def get_queryset(self):
+        if date_from is not None:
+            history = history.filter(date__gte=date_from)
+        if date_to is not None:
+            history = history.filter(date__lt=date_to)
+        paginator = HistoryCursorPagination()
+        page = paginator.paginate_queryset(
+            history.values("date", "quantity"), self.request, view=self
+        )
+        if use_fast_serializers():
+            with serializing():
+                page = [history_item(row) for row in page]
+
+        return {
+            "book": {"key": book.id, "title": book.title},
+            "start_balance": start_balance,
+            "end_balance": end_balance,
+            "history": page,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+        }
+
+    def perform_create(self, serializer):
         """
-        Filter the queryset to include only the Book with the given ID.
+        Save the Storing row and add it to the book balance atomically.
         """
-        return Book.objects.filter(id=self.kwargs.get("pk"))
+        with transaction.atomic():
+            storing = serializer.save()
+            apply_stock_deltas(
+                {storing.book_id: storing.quantity}, storing.shop_id
+            )
+
+
+class StockAtView(APIView):
+    """
+    View to report stock balances at a point in time.
+    """
+
+    def get(self, request):
+        query = StockAtSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        at = query.validated_data.get("at") or timezone.now()
+        books = balances_at(at).values("id", "barcode", "title", "quantity")
+
+        barcode = query.validated_data.get("barcode")
+        if barcode:
+            book = get_object_or_404(books, barcode=barcode)
+            return Response(
+                {
+                    "book": book["id"],
+                    "barcode": book["barcode"],
+                    "title": book["title"],
+                    "at": at,
+                    "quantity": book["quantity"],
+                }
+            )
+
+        paginator = CatalogCursorPagination()
+        page = paginator.paginate_queryset(books, request, view=self)
+        items = [
+            {
+                "book": book["id"],
+                "barcode": book["barcode"],
+                "title": book["title"],
+                "quantity": book["quantity"],
+            }
+            for book in page
+        ]
+        response = paginator.get_paginated_response(items)
+        response.data["at"] = at
+        return response
+
+
+class StockLedgerView(APIView):
+    """
+    View to list a book's Storing history with the running balance.
+    """
+
+    def get(self, request, pk):
+        book = get_object_or_404(Book.objects.only("id", "title"), pk=pk)
+        filters = HistoryFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        rows = running_balances(
+            book.id,
+            filters.validated_data.get("date_from"),
+            filters.validated_data.get("date_to"),
+        )
+        paginator = LedgerPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        return Response(
+            {
+                "book": {"key": book.id, "title": book.title},
+                "found": paginator.count,
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
+                "ledger": page,
+            }
+        )
+
+
+class ShopListView(generics.ListCreateAPIView):
+    """
+    View to list and create Shop instances.
+    """
+
+    queryset = Shop.objects.all()
+    serializer_class = ShopSerializer
+    pagination_class = CatalogCursorPagination
+
+
+class BookStockView(APIView):
+    """
+    View to report the stock of a book in every shop and in total, read from
+    the maintained shop balances.
+    """
+
+    def get(self, request, pk):
+        book = get_object_or_404(Book.objects.only("id", "barcode", "title"), pk=pk)
+        shops = list(
+            ShopStock.objects.filter(book=book)
+            .order_by("shop_id")
+            .values("shop_id", "shop__name", "quantity")
+        )
+        return Response(
+            {
+                "book": book.id,
+                "barcode": book.barcode,
+                "title": book.title,
+                "quantity": sum(shop["quantity"] for shop in shops),
+                "shops": [
+                    {
+                        "shop": shop["shop_id"],
+                        "name": shop["shop__name"],
+                        "quantity": shop["quantity"],
+                    }
+                    for shop in shops
+                ],
+            }
+        )
+
+
+class ShopStockView(APIView):
+    """
+    View to list the stock of every book in a shop.
+    """
+
+    def get(self, request, pk):
+        shop = get_object_or_404(Shop, pk=pk)
+        stock = ShopStock.objects.filter(shop=shop).values(
+            "id", "book_id", "book__barcode", "book__title", "quantity"
+        )
+        paginator = CatalogCursorPagination()
+        page = paginator.paginate_queryset(stock, request, view=self)
+        response = paginator.get_paginated_response(
+            [
+                {
+                    "book": row["book_id"],
+                    "barcode": row["book__barcode"],
+                    "title": row["book__title"],
+                    "quantity": row["quantity"],
+                }
+                for row in page
+            ]
+        )
+        response.data["shop"] = {"id": shop.id, "name": shop.name}
+        return response
 
 
 class BooksLeftOverView(APIView):
@@ -119,32 +476,133 @@ class BooksLeftOverView(APIView):
     def post(self, request):
         barcode = request.data.get("barcode")
         quantity = request.data.get("quantity")
-
-        if not barcode or not isinstance(quantity, int):
+        shop = request.data.get("shop")
+
+        if (
+            not barcode
+            or not isinstance(barcode, str)
+            or not is_integer(quantity)
+            or not (shop is None or is_integer(shop))
+        ):
             return Response(
                 {"error": "Invalid input data."}, status=status.HTTP_400_BAD_REQUEST
             )
-
-        # Get the book or return a 404 response if it doesn't exist
-        book = get_object_or_404(Book, barcode=barcode)
-
-        # Get or create BooksLeftOver instance for the book
-        leftover, created = BooksLeftOver.objects.get_or_create(
-            book=book, defaults={"quantity": 0}
-        )
+        if shop is not None and not existing_shops([shop]):
+            return Response(
+                {"error": "Unknown shop."}, status=status.HTTP_400_BAD_REQUEST
+            )
 
         # Update quantity based on the URL name
-        if self.request.resolver_match.url_name == "add-leftover":
-            leftover.quantity += int(quantity)
-        elif self.request.resolver_match.url_name == "remove-leftover":
-            leftover.quantity -= int(quantity)
+        if self.request.resolver_match.url_name == "remove-leftover":
+            quantity = -quantity
+
+        try:
+            leftover = adjust_leftover(barcode, quantity, shop)
+        except Book.DoesNotExist:
+            raise Http404("No Book matches the given query.")
 
-        leftover.save()
         serializer = CreateBooksLeftOverSerializer(leftover, many=False)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class BooksLeftOverBatchView(APIView):
+    """
+    View to apply a batch of leftover adjustments from a scanner device.
+
+    Accepts a list of ``{"barcode", "quantity", "op"}`` entries, ``op`` being
+    "add" or "remove", with an optional ``shop``. All barcodes and shops are
+    resolved with one query each and the valid entries are applied in one
+    transaction. Every entry gets a result with either the book balance
+    after it or an error.
+    """
+
+    operations = {"add": 1, "remove": -1}
+
+    def post(self, request):
+        entries = request.data
+        max_items = getattr(settings, "LEFTOVER_BATCH_MAX_ITEMS", 1000)
+        if not isinstance(entries, list) or not entries or len(entries) > max_items:
+            return Response(
+                {"error": f"Expected a list of 1 to {max_items} entries."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = []
+        valid = []  # (result, barcode, delta, shop)
+        for index, entry in enumerate(entries):
+            entry = entry if isinstance(entry, dict) else {}
+            barcode = entry.get("barcode")
+            quantity = entry.get("quantity")
+            op = entry.get("op")
+            shop = entry.get("shop")
+            result = {"index": index, "barcode": barcode}
+            results.append(result)
+            # Checked before anything is hashed: lists or objects in any of
+            # these fields are reported like other invalid entries.
+            if (
+                not barcode
+                or not isinstance(barcode, str)
+                or not is_integer(quantity)
+                or not isinstance(op, str)
+                or op not in self.operations
+                or not (shop is None or is_integer(shop))
+            ):
+                result.update(status="error", error="Invalid input data.")
+            else:
+                valid.append((result, barcode, self.operations[op] * quantity, shop))
+
+        book_ids = resolve_barcodes(barcode for _, barcode, _, _ in valid)
+        shop_ids = existing_shops(
+            {shop for _, _, _, shop in valid if shop is not None}
+        )
+        store_list = []
+        applied = []
+        for result, barcode, delta, shop in valid:
+            book_id = book_ids.get(barcode)
+            if book_id is None:
+                result.update(status="error", error="No Book matches the given query.")
+                continue
+            if shop is not None and shop not in shop_ids:
+                result.update(status="error", error="Unknown shop.")
+                continue
+            storing = Storing(book_id=book_id, quantity=delta)
+            if shop is not None:
+                storing.shop_id = shop
+            store_list.append(storing)
+            applied.append((result, book_id, delta))
+
+        if store_list:
+            with transaction.atomic():
+                record_storing(store_list)
+                balances = dict(
+                    BooksLeftOver.objects.filter(
+                        book_id__in={book_id for _, book_id, _ in applied}
+                    ).values_list("book_id", "quantity")
+                )
+
+            # Walk back from the final balances to the balance after each entry.
+            for result, book_id, delta in reversed(applied):
+                result.update(status="ok", quantity=balances[book_id])
+                balances[book_id] -= delta
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class BulkCreateStorageView(APIView):
+    """
+    View to import Storing history from an uploaded text/excel file.
+
+    With ``?async=1`` (or ``BULK_IMPORT_ASYNC = True``) the file is queued
+    for the import workers and a job id is returned immediately. With
+    ``?shop=<id>`` the stock is booked to that shop instead of the default.
+    """
+
+    def is_async(self):
+        value = self.request.query_params.get("async")
+        if value is None:
+            return getattr(settings, "BULK_IMPORT_ASYNC", False)
+        return value.lower() in ("1", "true", "yes")
+
     def post(self, request):
         if "file" in request.data.keys():
             file = request.data["file"]
@@ -156,12 +614,31 @@ class BulkCreateStorageView(APIView):
                         "error": "Invalid file format. Only Excel (.xlsx) or text (.txt) files are allowed."
                     }
                 )
-            file_extension = file.name.split(".")[-1].lower()
+            shop = request.query_params.get("shop")
+            if shop is not None:
+                shop = int(shop) if shop.isdigit() else None
+                if not existing_shops([shop]):
+                    return Response(
+                        {"error": "Unknown shop."},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+            if self.is_async():
+                job = enqueue_import(file, shop)
+                return Response(
+                    {
+                        "job_id": job.id,
+                        "status": job.status,
+                        "status_url": reverse(
+                            "bulk-leftover-job", kwargs={"pk": job.id}
+                        ),
+                    },
+                    status=status.HTTP_202_ACCEPTED,
+                )
 
             if file_extension == "xlsx":
-                result = handle_excel(file)
+                result = handle_excel(file, shop_id=shop)
             else:
-                result = handle_text(file)
+                result = handle_text(file, shop_id=shop)
 
             if result != True:
                 return Response(result)
@@ -169,3 +646,12 @@ class BulkCreateStorageView(APIView):
             return Response({"success": "Data uploaded successfully"})
         else:
             return Response({"missing file": "please upload a text/excel file"})
+
+
+class BulkImportJobView(generics.RetrieveAPIView):
+    """
+    View to report the progress of a background bulk import.
+    """
+
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
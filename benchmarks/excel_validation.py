@@ -0,0 +1,123 @@
+"""
+Compare the original ``iterrows`` validation of Excel uploads with the
+column-wise validation in ``api.excel``.
+
+Both sides work on the same synthetic sheet and resolve barcodes from the
+same in-memory map, so only the validation itself is timed (the original
+code additionally ran one or two queries per row).
+
+    python benchmarks/excel_validation.py --rows 500000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.excel import not_found_messages, validate_frame  # noqa: E402
+
+
+def make_frame(rows, books, seed=0):
+    """
+    Synthetic sheet: mostly valid rows plus blank, invalid and unknown ones.
+    """
+    rng = np.random.default_rng(seed)
+    barcodes = rng.integers(1, books * 1.05, rows).astype(object)
+    quantities = rng.integers(-50, 50, rows).astype(object)
+    kind = rng.random(rows)
+    quantities[kind < 0.01] = None
+    quantities[(kind >= 0.01) & (kind < 0.02)] = "n/a"
+    return pd.DataFrame(
+        {
+            "row_number": np.arange(2, rows + 2),
+            "barcode": barcodes,
+            "quantity": quantities,
+        }
+    )
+
+
+def legacy(df, book_ids):
+    """
+    The per-row loop ``handle_excel`` used before the vectorized pipeline.
+    """
+    df = df.drop(columns="row_number")
+    df["is_null"] = df["quantity"].isnull()
+    errors = []
+    store_list = []
+    for index, row in df.iterrows():
+        barcode = row.get("barcode", "")
+        quantity = row.get("quantity", "")
+        is_null = row.get("is_null")
+        if not barcode:
+            continue
+        try:
+            if is_null:
+                errors.append(f"Error at row {index + 2}. Quantity cannot be blank.")
+            else:
+                quantity = int(quantity)
+                book_id = book_ids.get(str(barcode))
+                if book_id is None:
+                    errors.append(
+                        f"Error at row {index + 2}. Book with barcode: {barcode} does not exist"
+                    )
+                else:
+                    store_list.append((book_id, quantity))
+        except ValueError:
+            errors.append(
+                f"Invalid quantity at row {index + 2}. Quantity must be a number."
+            )
+    return errors, store_list
+
+
+def vectorized(df, book_ids):
+    clean, errors = validate_frame(df)
+    book_id = clean["barcode"].map(book_ids)
+    missing = book_id.isna()
+    not_found = not_found_messages(
+        clean["row_number"][missing], clean["barcode"][missing]
+    )
+    store_list = list(
+        zip(book_id[~missing].astype("int64"), clean["quantity"][~missing])
+    )
+    return len(errors) + len(not_found), store_list
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--books", type=int, default=100000)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows, args.books)
+    book_ids = {str(i): i for i in range(1, args.books + 1)}
+
+    legacy_time, (legacy_errors, legacy_rows) = timed(legacy, df.copy(), book_ids)
+    vector_time, (vector_errors, vector_rows) = timed(vectorized, df, book_ids)
+    assert (len(legacy_errors), len(legacy_rows)) == (vector_errors, len(vector_rows))
+
+    print(
+        json.dumps(
+            {
+                "rows": args.rows,
+                "iterrows_seconds": round(legacy_time, 3),
+                "vectorized_seconds": round(vector_time, 3),
+                "speedup": round(legacy_time / vector_time, 1),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
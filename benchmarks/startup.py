@@ -0,0 +1,114 @@
+"""
+Time the startup of a web worker: setting up Django, loading the URLconf
+with every view, and building the WSGI application, as a uWSGI worker does
+before its first request.
+
+Every run is a fresh interpreter, so nothing is cached between runs. The
+report has the median and worst wall time and the peak RSS of the runs, the
+slowest imports from ``python -X importtime``, and which of the heavy
+modules (pandas, NumPy, openpyxl) got loaded. With ``--max-ms`` or
+``--forbid`` the script exits with status 1 on a regression, so it can run
+in CI.
+
+    python benchmarks/startup.py --runs 10 --max-ms 1500 --forbid pandas
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl")
+
+# Runs in the child interpreter; prints its measurements as JSON.
+WORKER = """
+import json, resource, sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+seconds = time.perf_counter() - start
+print(json.dumps({
+    "ms": seconds * 1000,
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_worker(importtime=False):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "book_storage.settings"}
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    result = subprocess.run(
+        command + ["-c", WORKER],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout), result.stderr
+
+
+def slowest_imports(importtime_output, count):
+    """
+    The top-level packages with the largest cumulative import time, in ms.
+    """
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented further than top-level ones.
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            totals[name.strip()] = int(cumulative) / 1000
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return {name: round(ms, 1) for name, ms in ranked[:count]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports shown.")
+    parser.add_argument("--max-ms", type=float, help="Fail above this median.")
+    parser.add_argument(
+        "--forbid",
+        action="append",
+        default=[],
+        choices=HEAVY_MODULES,
+        help="Fail if this module is loaded at startup; can be repeated.",
+    )
+    args = parser.parse_args()
+
+    runs = [run_worker()[0] for _ in range(args.runs)]
+    _, importtime_output = run_worker(importtime=True)
+    times = sorted(run["ms"] for run in runs)
+    report = {
+        "runs": args.runs,
+        "median_ms": round(statistics.median(times), 1),
+        "max_ms": round(times[-1], 1),
+        "maxrss_mb": round(max(run["maxrss_kb"] for run in runs) / 1024, 1),
+        "heavy_modules_loaded": runs[0]["loaded"],
+        "slowest_imports_ms": slowest_imports(importtime_output, args.top),
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if args.max_ms is not None and report["median_ms"] > args.max_ms:
+        failures.append(f"median startup {report['median_ms']} ms > {args.max_ms} ms")
+    for name in args.forbid:
+        if name in report["heavy_modules_loaded"]:
+            failures.append(f"{name} is imported at startup")
+    if failures:
+        sys.exit("Startup regression: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Connection pooling for the database backends in this package.
+
+With ``OPTIONS["pool"]`` a backend keeps the connections Django closes at
+the end of a request open in a per-process pool, and hands them to the next
+thread that needs a connection, instead of connecting again. The pool holds
+at most ``max_size`` connections, idle or in use; when all of them are in
+use, threads wait up to ``timeout`` seconds for one to be returned. Idle
+connections are closed after ``idle_timeout`` seconds, and with
+``CONN_HEALTH_CHECKS`` reused connections are tested with ``SELECT 1``
+first. Leave ``CONN_MAX_AGE`` at 0 so connections go back to the pool after
+every request and are shared by all threads.
+"""
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+DEFAULT_POOL_OPTIONS = {"max_size": 10, "idle_timeout": 300, "timeout": 10}
+
+# Pools by alias and database name, shared by the threads of this process.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, name, options):
+    with _pools_lock:
+        key = (alias, str(name))
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**{**DEFAULT_POOL_OPTIONS, **options})
+        return _pools[key]
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, max_size, idle_timeout, timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.idle = deque()  # (connection, returned at), most recent last
+        self.size = 0  # Open connections, idle or in use.
+        self.started = time.monotonic()
+        self.checkouts = 0
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.closed_idle = 0
+        self.discarded = 0
+
+    def pop_expired(self, now):
+        """
+        Remove the connections idle for longer than ``idle_timeout``.
+        """
+        expired = []
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            expired.append(self.idle.popleft()[0])
+        self.size -= len(expired)
+        self.closed_idle += len(expired)
+        return expired
+
+    def checkout(self, connect, check=None):
+        """
+        Return an idle connection that passes ``check``, or a new one from
+        ``connect`` if the pool is not full yet.
+        """
+        started = time.monotonic()
+        waited = False
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                expired = self.pop_expired(now)
+                if self.idle:
+                    conn = self.idle.pop()[0]
+                    break
+                if self.size < self.max_size:
+                    # Reserve the slot of the new connection.
+                    self.size += 1
+                    conn = None
+                    break
+                remaining = self.timeout - (now - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise OperationalError(
+                        f"No database connection was returned to the pool of "
+                        f"{self.max_size} within {self.timeout} seconds."
+                    )
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self.condition.wait(remaining)
+            self.checkouts += 1
+            if waited:
+                self.wait_seconds += time.monotonic() - started
+        for expired_conn in expired:
+            close_quietly(expired_conn)
+
+        if conn is not None:
+            if check is None or check(conn):
+                with self.condition:
+                    self.reused += 1
+                return conn
+            # Replace the broken connection, keeping its slot.
+            close_quietly(conn)
+            with self.condition:
+                self.discarded += 1
+        try:
+            conn = connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created += 1
+        return conn
+
+    def checkin(self, conn, reusable=True):
+        with self.condition:
+            if reusable:
+                self.idle.append((conn, time.monotonic()))
+            else:
+                self.size -= 1
+                self.discarded += 1
+            self.condition.notify()
+        if not reusable:
+            close_quietly(conn)
+
+    def stats(self):
+        with self.condition:
+            uptime = time.monotonic() - self.started
+            return {
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "reused": self.reused,
+                "created_per_s": round(self.created / uptime, 3) if uptime else None,
+                "waits": self.waits,
+                "wait_ms": round(self.wait_seconds * 1000, 3),
+                "timeouts": self.timeouts,
+                "closed_idle": self.closed_idle,
+                "discarded": self.discarded,
+            }
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Take connections from a ``ConnectionPool`` if ``OPTIONS["pool"]`` is
+    set. Backends set up new connections in ``setup_connection``, which only
+    runs once per connection, not on every checkout.
+    """
+
+    @property
+    def pool(self):
+        options = self.settings_dict["OPTIONS"].get("pool")
+        in_memory = getattr(self, "is_in_memory_db", lambda: False)()
+        # Closing an in-memory database destroys it: it is never pooled.
+        if not options or in_memory:
+            return None
+        return get_pool(self.alias, self.settings_dict["NAME"], options)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop("pool", None)
+        return kwargs
+
+    def setup_connection(self, conn):
+        pass
+
+    def connect_new(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        self.setup_connection(conn)
+        return conn
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return self.connect_new(conn_params)
+        check = None
+        if self.settings_dict["CONN_HEALTH_CHECKS"]:
+            check = self.check_pooled_connection
+        return pool.checkout(lambda: self.connect_new(conn_params), check)
+
+    def check_pooled_connection(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # Never hand over a connection with an open transaction.
+        try:
+            self.connection.rollback()
+        except Exception:
+            reusable = False
+        else:
+            reusable = True
+        pool.checkin(self.connection, reusable)
@@ -0,0 +1,11 @@
+"""
+PostgreSQL backend with the connection pool of
+``book_storage.db_backends.pool``, enabled with ``OPTIONS["pool"]``.
+"""
+from django.db.backends.postgresql import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,117 @@
+"""
+SQLite backend tuned for a few processes serving concurrent requests.
+
+Every new connection is set up with the PRAGMAs in ``OPTIONS["pragmas"]``
+(by default ``DEFAULT_PRAGMAS``): WAL journaling, so readers no longer wait
+for writers, ``synchronous=NORMAL``, which is safe with WAL, a busy timeout
+and larger page and mmap caches.
+
+Transactions start with ``BEGIN IMMEDIATE`` (``OPTIONS["transaction_mode"]``,
+named as in Django 5.1). With a plain ``BEGIN`` two transactions that both
+read before writing deadlock on the upgrade to a write lock, and one of
+them fails with "database is locked" at once, without waiting for the busy
+timeout. With ``OPTIONS["serialize_writes"]``
+the transactions of the threads of one process also queue on a lock before
+asking SQLite, so that only one connection per process competes for the
+database file. Connections are pooled with ``OPTIONS["pool"]``, see
+``book_storage.db_backends.pool``.
+"""
+import threading
+
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseWrapperMixin
+
+Database = base.Database
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64000,  # KiB, i.e. 64 MB
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+# Write locks by database name, shared by the threads of this process.
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+def get_write_lock(name):
+    with _write_locks_lock:
+        return _write_locks.setdefault(str(name), threading.Lock())
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.holds_write_lock = False
+
+    @property
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict["OPTIONS"].get("pragmas", {})}
+
+    @property
+    def serialize_writes(self):
+        return self.settings_dict["OPTIONS"].get("serialize_writes", True)
+
+    @property
+    def transaction_mode(self):
+        return self.settings_dict["OPTIONS"].get("transaction_mode", "IMMEDIATE")
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for option in ("pragmas", "serialize_writes", "transaction_mode"):
+            kwargs.pop(option, None)
+        return kwargs
+
+    def setup_connection(self, conn):
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+    def get_write_timeout(self):
+        return int(self.pragmas.get("busy_timeout", 5000)) / 1000
+
+    def acquire_write_lock(self):
+        # An in-memory database has no file to contend for, and its test
+        # transactions span whole test cases.
+        if not self.serialize_writes or self.is_in_memory_db():
+            return
+        if not get_write_lock(self.settings_dict["NAME"]).acquire(
+            timeout=self.get_write_timeout()
+        ):
+            raise Database.OperationalError("database is locked")
+        self.holds_write_lock = True
+
+    def release_write_lock(self):
+        if self.holds_write_lock:
+            self.holds_write_lock = False
+            get_write_lock(self.settings_dict["NAME"]).release()
+
+    def _start_transaction_under_autocommit(self):
+        with self.wrap_database_errors:
+            self.acquire_write_lock()
+        try:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
+        except Exception:
+            self.release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
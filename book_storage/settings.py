@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.instrumentation.InstrumentationMiddleware",
+    "api.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,13 +78,53 @@ WSGI_APPLICATION = "book_storage.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# The SQLite backend in book_storage.db_backends.sqlite3 sets up every
+# connection for concurrent use (WAL, synchronous=NORMAL, busy timeout,
+# mmap and page cache; override them in OPTIONS["pragmas"]), starts
+# transactions with BEGIN IMMEDIATE and queues the write transactions of
+# the threads of a process ("serialize_writes").
+# Connections go back to a per-process pool at the end of every request
+# ("pool": at most max_size connections, waiting up to timeout seconds for
+# a free one, closed after idle_timeout seconds idle), so CONN_MAX_AGE stays
+# 0. With CONN_HEALTH_CHECKS they are tested before they are reused. The
+# pool's metrics are served by /api/internal/stats/. For PostgreSQL use the
+# pooled "book_storage.db_backends.postgresql" backend with the same "pool".
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "book_storage.db_backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "pragmas": {"busy_timeout": 5000},
+            "serialize_writes": True,
+            "transaction_mode": "IMMEDIATE",
+            "pool": {"max_size": 10, "idle_timeout": 300, "timeout": 10},
+        },
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read replicas
+# Writes always go to "default", the primary. Reads are spread over the
+# aliases in DATABASE_REPLICAS, except for REPLICA_STICKY_SECONDS after a
+# client wrote, so that it reads its own writes. Locally, SQLite copies of
+# the primary refreshed by "manage.py sync_replicas" can stand in for
+# replicas, e.g.
+#
+#     DATABASES["replica1"] = {
+#         "ENGINE": "book_storage.db_backends.sqlite3",
+#         "NAME": BASE_DIR / "db-replica1.sqlite3",
+#         "TEST": {"MIRROR": "default"},
+#     }
+#     DATABASE_REPLICAS = ["replica1"]
+
+DATABASE_ROUTERS = ["api.routers.PrimaryReplicaRouter"]
+
+DATABASE_REPLICAS = []
+
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -120,7 +162,123 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded files, e.g. bulk imports waiting for a background worker
+
+MEDIA_ROOT = BASE_DIR / "media"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Bulk storage imports
+# Uploads are read and written in chunks of this many rows.
+
+BULK_IMPORT_CHUNK_SIZE = 5000
+
+# Parse the sheets of .xlsx uploads in up to this many worker processes, one
+# sheet per process. 0 or 1 streams them in-process.
+
+BULK_IMPORT_EXCEL_WORKERS = 0
+
+# Queue uploads for `manage.py run_import_workers` instead of importing them
+# inside the request. Can be chosen per request with `?async=1`.
+
+BULK_IMPORT_ASYNC = False
+
+# A running import job whose worker sent no heartbeat for this many seconds
+# (e.g. because it was killed) is claimed again by another worker, which
+# resumes it after the chunks saved so far.
+
+IMPORT_JOB_LEASE_SECONDS = 300
+
+# Import jobs keep the first IMPORT_JOB_MAX_ERRORS error messages; rows_failed
+# counts all of them.
+
+IMPORT_JOB_MAX_ERRORS = 1000
+
+
+# Stock written without a shop, e.g. by clients that predate shops, is
+# booked to this shop. Migration 0011 creates it as "Main".
+
+DEFAULT_SHOP_ID = 1
+
+
+# Largest number of entries accepted by /api/leftover/batch/
+
+LEFTOVER_BATCH_MAX_ITEMS = 1000
+
+
+# Catalog pagination
+# List endpoints return at most API_PAGE_SIZE items per page (clients can ask
+# for up to API_MAX_PAGE_SIZE with `?page_size=`). The "found" total can be
+# cached for API_COUNT_CACHE_TIMEOUT seconds; 0 counts on every request.
+
+API_PAGE_SIZE = 100
+
+API_MAX_PAGE_SIZE = 1000
+
+API_COUNT_CACHE_TIMEOUT = 0
+
+# Build the book list, author list and history pages from values() rows
+# instead of DRF serializers. The JSON is identical either way.
+
+API_FAST_SERIALIZERS = True
+
+# Response cache
+# GET responses of the book, author and history endpoints are cached for
+# API_CACHE_TIMEOUT seconds (0 disables the cache) in the API_CACHE_ALIAS
+# cache and invalidated whenever the data they show changes. The local-memory
+# cache is per process and evicts the least recently used entries; to share
+# one cache between processes use e.g.
+# "django.core.cache.backends.filebased.FileBasedCache" with
+# "LOCATION": BASE_DIR / "cache".
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "api": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "api-responses",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+API_CACHE_ALIAS = "api"
+
+API_CACHE_TIMEOUT = 0
+
+# Rows fetched from the database and written per chunk by the
+# /api/export/ endpoints.
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Request instrumentation
+# Latency, query count, DB time and render time of every API request,
+# aggregated per URL name and served to INTERNAL_IPS on /api/internal/stats/.
+# INSTRUMENTATION_LOG_REQUESTS also logs every request as a JSON line on the
+# "api.instrumentation" logger.
+
+INSTRUMENTATION_ENABLED = True
+
+INSTRUMENTATION_LOG_REQUESTS = False
+
+INTERNAL_IPS = ["127.0.0.1"]
+
+# History rows per page of /api/history/<pk>/
+
+HISTORY_PAGE_SIZE = 100
+
+# Stock snapshots are taken at least this many seconds in the past, so that
+# no transaction still in flight adds history dated before them.
+
+STOCK_SNAPSHOT_MARGIN_SECONDS = 900
+
+# `manage.py compact_stock_history` folds history older than this many days
+# into snapshots, archiving the raw rows to STOCK_HISTORY_ARCHIVE_DIR if set.
+
+STOCK_HISTORY_RETENTION_DAYS = 365
+
+STOCK_HISTORY_ARCHIVE_DIR = None